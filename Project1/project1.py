@@ -1,6 +1,13 @@
 import argparse
+import heapq
+import mmap
+import os
+import re
+import sqlite3
 import string
-from collections import defaultdict
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from ascii_graph import Pyasciigraph
 from ascii_graph.colors import *
 from ascii_graph.colordata import vcolor
@@ -8,51 +15,217 @@ from pathlib import Path
 from tqdm import tqdm
 import time
 
-parser = argparse.ArgumentParser(description='This is a script for argparse')
-parser.add_argument('-f', '--filename', help='File to process')
-parser.add_argument('-n', '--number', help='Number of words to appear in a histogram', type=int, default=10)
-parser.add_argument('-l', '--length', help='Minimal length of the word to appear in a histogram', type=int, default=0)
-parser.add_argument('-L', '--list', help='A list of words to ignore', nargs='*', default=[])
-parser.add_argument('-c', '--chars', help='Sequences of characters to ignore', nargs='*', default=[])
-parser.add_argument('-C', '--characters', help='Sequences of characters that must appear in words', nargs='*', default=[])
-parser.add_argument('-F', '--folder', help='Folder to search in')
-args = parser.parse_args()
-
-d = defaultdict(int)   # initialise a dictionary
-
-translator = str.maketrans('', '', string.punctuation + '–')   # make text uniform (remove capital letters and punctuation)
-
-if args.folder:   # process all .txt files in a given folder
-    folder = Path(args.folder)
-    for files in folder.glob('*.txt'):
-        with open(files, 'r', encoding='utf-8') as file:
-            for line in tqdm(file, desc=f'Processing {files.name}', unit=' lines'):   # progress bar
-                time.sleep(0.01)   # artificial delay to see progress
-                line = line.translate(translator).lower()
-                words = line.split()   # split a line into separate words
-                for word in words:   # process each word separately
-                    if len(word) >= args.length and (not args.characters or any(seq in word for seq in args.characters)):
-                        if word in args.list or (args.chars and any(seq in word for seq in args.chars)):
-                            continue
-                        d[word] += 1
-else:   # process a given .txt file
-    with open(args.filename, 'r', encoding='utf-8') as file:
-        for line in tqdm(file, desc=f'Processing {args.filename}', unit=' lines'):   # progress bar
-            time.sleep(0.01)   # artificial delay to see progress
-            line = line.translate(translator).lower()
-            words = line.split()   # split a line into separate words
-            for word in words:   # process each word separately
-                if len(word) >= args.length and (not args.characters or any(seq in word for seq in args.characters)):
-                    if word in args.list or (args.chars and any(seq in word for seq in args.chars)):
-                        continue
-                    d[word] += 1
-
-sorted_d = dict(sorted(d.items(), key=lambda x: x[1], reverse=True))   # sort a dictionary in a descending order for keys
-trimmed = list(sorted_d.items())[:args.number]   # convert a sorted dictionary into a list (needed for ascii_graph) and trim to a given number of words
-
-graph = Pyasciigraph()   # prepare a graph
-pattern = [IPur , Pur, ICya, Cya, Blu]   # prepare an array of colours
-data = vcolor(trimmed, pattern)   # build a 'coloured' data list
-
-for line in graph.graph('Sample Graph', data):
-    print(line)
\ No newline at end of file
+PUNCTUATION = string.punctuation.encode()   # make text uniform (remove capital letters and punctuation) -- deleting ASCII bytes
+DASH = '–'.encode()                        # from UTF-8 directly is much faster than str.translate and never splits a character
+WHITESPACE = b' \t\n\r\x0b\x0c'   # block boundaries are moved to ASCII whitespace, so no word (or UTF-8 character) is cut in two
+
+# Compile a list of character sequences into one regex matching any of them (None if the list is empty)
+def compile_sequences(sequences):
+    if not sequences:
+        return None
+    return re.compile('|'.join(re.escape(seq) for seq in sorted(sequences, key=len, reverse=True)))
+
+# Split a file into byte ranges of roughly block_size bytes
+def blocks(path, block_size):
+    size = os.path.getsize(path)
+    return [(path, start, min(start + block_size, size)) for start in range(0, size, block_size)]
+
+# Move a block boundary forward past the word it cuts (to the next whitespace byte or the end of the file)
+def boundary(mm, position):
+    if position == 0 or mm[position - 1] in WHITESPACE:
+        return position
+    while position < len(mm) and mm[position] not in WHITESPACE:
+        position += 1
+    return position
+
+# Count the words in one byte range of a file -- the text is tokenised in bulk and the filters run once per distinct word
+def count_block(task, length=0, ignore=frozenset(), chars=None, characters=None, delay=0):
+    path, start, end = task
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start, end = boundary(mm, start), boundary(mm, end)   # a word across a boundary belongs to the block it starts in
+        text = mm[start:end].translate(None, PUNCTUATION).replace(DASH, b'').decode('utf-8')
+    if delay:
+        time.sleep(delay)   # artificial delay to see progress
+    counts = Counter(text.lower().split())
+    return Counter({word: count for word, count in counts.items()
+                    if len(word) >= length
+                    and (characters is None or characters.search(word))
+                    and word not in ignore
+                    and (chars is None or not chars.search(word))})
+
+# Mergeable Space-Saving summary: at most `capacity` words with upper-bound counts and their maximal overestimates,
+# every word left out has a true count of at most `floor`
+class SpaceSaving:
+    def __init__(self, capacity, counts=None, errors=None, floor=0):
+        self.capacity = capacity
+        self.counts = counts or {}
+        self.errors = errors or {}
+        self.floor = floor
+
+    # Summary of exact counts (e.g. of one block) -- keep the `capacity` largest
+    @classmethod
+    def from_counts(cls, counts, capacity):
+        summary = cls(capacity, dict(counts), dict.fromkeys(counts, 0))
+        summary.trim()
+        return summary
+
+    # Drop all but the `capacity` largest counts, the largest dropped one bounds everything missing
+    def trim(self):
+        if len(self.counts) <= self.capacity:
+            return
+        kept = heapq.nlargest(self.capacity + 1, self.counts.items(), key=lambda x: x[1])
+        self.floor = max(self.floor, kept.pop()[1])
+        self.counts = dict(kept)
+        self.errors = {word: self.errors[word] for word in self.counts}
+
+    # Combine with another summary -- a word missing from one side may have up to its floor there
+    def merge(self, other):
+        for word in self.counts.keys() - other.counts.keys():
+            self.counts[word] += other.floor
+            self.errors[word] += other.floor
+        for word, count in other.counts.items():
+            self.counts[word] = self.counts.get(word, self.floor) + count
+            self.errors[word] = self.errors.get(word, self.floor) + other.errors[word]
+        self.floor += other.floor
+        self.trim()
+        return self
+
+    # Top words as (word, count upper bound, overestimate bound)
+    def most_common(self, n):
+        return [(word, count, self.errors[word]) for word, count in heapq.nlargest(n, self.counts.items(), key=lambda x: x[1])]
+
+def summarise_block(task, capacity, **filters):
+    return SpaceSaving.from_counts(count_block(task, **filters), capacity)
+
+# Count the blocks (in a process pool if there is more than one) and yield the results in input order
+def count_blocks(tasks, count, workers=None):
+    with tqdm(total=sum(end - start for _, start, end in tasks), desc='Processing', unit='B', unit_scale=True) as progress:   # progress bar
+        if len(tasks) > 1 and workers != 1:
+            with ProcessPoolExecutor(workers) as pool:
+                for task, counts in zip(tasks, pool.map(count, tasks)):
+                    progress.update(task[2] - task[1])
+                    yield task, counts
+        else:
+            for task in tasks:
+                counts = count(task)
+                progress.update(task[2] - task[1])
+                yield task, counts
+
+# Open (or create) the on-disk index: unfiltered word counts per file and their totals over the whole corpus
+def open_index(path):
+    db = sqlite3.connect(path)
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime INTEGER, size INTEGER);
+        CREATE TABLE IF NOT EXISTS counts (file INTEGER, word TEXT, count INTEGER, PRIMARY KEY (file, word)) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS totals (word TEXT PRIMARY KEY, count INTEGER);
+    ''')
+    db.create_function('regexp', 2, lambda pattern, word: re.search(pattern, word) is not None, deterministic=True)   # backs the REGEXP operator
+    return db
+
+# Bring the index up to date with the given files -- only new or changed ones (by mtime and size) are re-tokenised
+def update_index(db, paths, block_size, workers=None, delay=0):
+    stats = {str(path.resolve()): path.stat() for path in paths}
+    with db:   # one transaction
+        for file, path, mtime, size in db.execute('SELECT id, path, mtime, size FROM files').fetchall():
+            stat = stats.get(path)
+            if stat is None or (stat.st_mtime_ns, stat.st_size) != (mtime, size):   # removed or changed file
+                removed = db.execute('SELECT count, word FROM counts WHERE file = ?', (file,)).fetchall()
+                db.executemany('UPDATE totals SET count = count - ? WHERE word = ?', removed)
+                db.execute('DELETE FROM counts WHERE file = ?', (file,))
+                db.execute('DELETE FROM files WHERE id = ?', (file,))
+        db.execute('DELETE FROM totals WHERE count = 0')
+
+        indexed = {path for path, in db.execute('SELECT path FROM files')}
+        tasks = [task for path in stats if path not in indexed for task in blocks(path, block_size)]
+        counts = {}
+        for (path, _, _), block in count_blocks(tasks, partial(count_block, delay=delay), workers):
+            counts.setdefault(path, Counter()).update(block)
+        for path, stat in stats.items():
+            if path in indexed:
+                continue
+            file = db.execute('INSERT INTO files (path, mtime, size) VALUES (?, ?, ?)', (path, stat.st_mtime_ns, stat.st_size)).lastrowid
+            words = counts.get(path, Counter()).items()
+            db.executemany('INSERT INTO counts VALUES (?, ?, ?)', ((file, word, count) for word, count in words))
+            db.executemany('INSERT INTO totals VALUES (?, ?) ON CONFLICT (word) DO UPDATE SET count = count + excluded.count', words)
+
+# Apply the filters to the cached totals and return the `number` most frequent words (ties in order of first appearance)
+def query_index(db, number, length=0, ignore=(), chars=None, characters=None):
+    conditions, parameters = ['length(word) >= ?'], [length]
+    if ignore:
+        conditions.append(f'word NOT IN ({", ".join("?" * len(ignore))})')
+        parameters += list(ignore)
+    if characters:
+        conditions.append('word REGEXP ?')
+        parameters.append(characters.pattern)
+    if chars:
+        conditions.append('NOT word REGEXP ?')
+        parameters.append(chars.pattern)
+    return db.execute(f'SELECT word, count FROM totals WHERE {" AND ".join(conditions)} ORDER BY count DESC, rowid LIMIT ?',
+                      parameters + [number]).fetchall()
+
+def main():
+    parser = argparse.ArgumentParser(description='This is a script for argparse')
+    parser.add_argument('-f', '--filename', help='File to process')
+    parser.add_argument('-n', '--number', help='Number of words to appear in a histogram', type=int, default=10)
+    parser.add_argument('-l', '--length', help='Minimal length of the word to appear in a histogram', type=int, default=0)
+    parser.add_argument('-L', '--list', help='A list of words to ignore', nargs='*', default=[])
+    parser.add_argument('-c', '--chars', help='Sequences of characters to ignore', nargs='*', default=[])
+    parser.add_argument('-C', '--characters', help='Sequences of characters that must appear in words', nargs='*', default=[])
+    parser.add_argument('-F', '--folder', help='Folder to search in')
+    parser.add_argument('-w', '--workers', help='Number of worker processes (default: number of CPUs)', type=int, default=None)
+    parser.add_argument('--block-size', help='Size of the byte ranges counted by one worker task (MB)', type=float, default=16)
+    parser.add_argument('-d', '--delay', help='Artificial delay per block to see progress (s)', type=float, default=0)
+    parser.add_argument('-a', '--approx', help='Track only the heaviest words in a fixed-memory Space-Saving summary and report error bounds', action='store_true')
+    parser.add_argument('--capacity', help='Number of words kept in the --approx summary', type=int, default=1000)
+    parser.add_argument('-i', '--index', help='SQLite file caching per-file word counts between runs (one index per corpus)', type=str)
+    args = parser.parse_args()
+    if args.approx and args.index:
+        parser.error('--approx and --index cannot be combined (the index already holds exact counts)')
+
+    # Step 1: Split the input into byte ranges (whole small files, several ranges of a big one)
+    paths = list(Path(args.folder).glob('*.txt')) if args.folder else [Path(args.filename)]   # process all .txt files in a given folder or a given .txt file
+    block_size = max(1, int(args.block_size * 2**20))
+    filters = dict(length=args.length, ignore=frozenset(args.list), chars=compile_sequences(args.chars),
+                   characters=compile_sequences(args.characters))
+
+    # Step 2: Count the blocks and merge the counters (or summaries) in input order, or update the index and query it
+    if args.index:
+        db = open_index(args.index)
+        update_index(db, paths, block_size, args.workers, args.delay)
+        trimmed = query_index(db, args.number, **filters)
+        db.close()
+    else:
+        if args.approx:
+            count = partial(summarise_block, capacity=max(args.capacity, args.number), delay=args.delay, **filters)
+            d = SpaceSaving(max(args.capacity, args.number))
+            merge = SpaceSaving.merge
+        else:
+            count = partial(count_block, delay=args.delay, **filters)
+            d = Counter()
+            merge = Counter.update
+        tasks = [task for path in paths for task in blocks(path, block_size)]
+        for _, counts in count_blocks(tasks, count, args.workers):
+            merge(d, counts)
+        if args.approx:
+            top = d.most_common(args.number)
+            trimmed = [(word, count) for word, count, _ in top]
+        else:
+            trimmed = d.most_common(args.number)   # partial selection of the largest counts instead of sorting the whole vocabulary
+
+    # Step 3: Plot the histogram
+    graph = Pyasciigraph()   # prepare a graph
+    pattern = [IPur , Pur, ICya, Cya, Blu]   # prepare an array of colours
+    data = vcolor(trimmed, pattern)   # build a 'coloured' data list
+
+    for line in graph.graph('Sample Graph', data):
+        print(line)
+
+    # Error bounds of the approximate counts: true count lies in [count - error, count]
+    if args.approx:
+        threshold = max([d.floor] + [count for _, count, _ in d.most_common(args.number + 1)[args.number:]])   # no word outside the list can exceed it
+        print(f'\nSpace-Saving summary of {d.capacity} words (words outside it have at most {d.floor} occurrences)')
+        for word, count, error in top:
+            print(f'{word}\t{count - error}..{count}' + ('' if count - error >= threshold else f'\t(not guaranteed to be in the top {args.number})'))
+
+if __name__ == '__main__':
+    main()
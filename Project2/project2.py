@@ -1,58 +1,170 @@
 import argparse
+import sys
+from pathlib import Path
 import numpy as np
 from scipy.signal import convolve2d
-from PIL import Image
-import glob
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.special import expit
 from rich.progress import track
 import time
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))   # make the shared 'common' package importable
+from common.metropolis import acceptance_table
+from common.observables import ObservableWriter
+from common.snapshots import SnapshotWriter
+from common import multispin
+from common.instrumentation import instrument, report, save_report
+from common.checkpoint import save_checkpoint, load_checkpoint, generator_state, restore_generator
+
 class Ising:    
 
-    def __init__(self, n, rho, J, B, b, S):
+    def __init__(self, n, rho, J, B, b, S, seed=None):
         self.n = int(n)
         self.rho = float(rho)
         self.J = float(J)
         self.B = float(B)
         self.b = float(b)
         self.S = int(S)
+        self.rng = np.random.default_rng(seed)   # own random stream, reproducible with a seed
 
         N = self.n * self.n   # total number of spins
         N_plus = int(rho * N)   # number of +1 spins
         N_minus = N - N_plus   # number of -1 spins
-        spins_init = np.array([1] * N_plus + [-1] * N_minus)
-        np.random.shuffle(spins_init)   # randomise spin distribution
+        spins_init = np.array([1] * N_plus + [-1] * N_minus, dtype=np.int8)   # 1 byte per spin
+        self.rng.shuffle(spins_init)   # randomise spin distribution
         self.spins = spins_init.reshape((self.n, self.n))
 
+        parity = np.add.outer(np.arange(self.n), np.arange(self.n)) % 2
+        self.sublattices = (parity == 0, parity == 1)   # red/black checkerboard masks
+
+        self.table = acceptance_table(self.J, self.B, self.b)   # Metropolis acceptance probabilities, built once
+
+        # Running totals, updated on each accepted flip -- E = -J * bonds - B * M stays exact in integers
+        self.bonds = self.calc_bonds(self.spins)   # sum of s_i s_j over bonds
+        self.M = int(np.sum(self.spins))   # sum of spins (magnetisation times N)
+
+        self.in_cluster = np.zeros((self.n, self.n), dtype=bool)   # cluster marks for Wolff updates
+
+
+    @property
+    def E(self):   # total energy from the running totals, O(1)
+        return -self.J * self.bonds - self.B * self.M
+
 
     def mc_step(self):
-        # Step 1: Choose a random spin and calculate energy before flipping
-        i = np.random.randint(0, self.n)
-        j = np.random.randint(0, self.n)
-        E_before = self.calc_local_energy(i, j)
-
-        # Step 2: Flip its value and calculate energy after it
-        if self.spins[i, j] == 1:
-            self.spins[i, j] = -1
-        else:
-            self.spins[i, j] = 1
-        E_after = self.calc_local_energy(i, j)
+        # Step 1: Choose a random spin
+        i = self.rng.integers(0, self.n)
+        j = self.rng.integers(0, self.n)
+        s = self.spins[i, j]
 
-        # Step 3: Calculate energy difference
-        dE = E_after - E_before
+        # Step 2: Sum its 4 nearest neighbours (% n creates boundary conditions)
+        nn = self.spins[(i-1) % self.n, j] + self.spins[(i+1) % self.n, j]\
+           + self.spins[i, (j-1) % self.n] + self.spins[i, (j+1) % self.n]
 
-        # Step 4: Acceptance of the random spin
-        if dE < 0:
-            pass
-        else:
-            p = np.random.uniform()
-            P = np.exp(-self.b * dE)
-            if p < P:
-                pass
-            else:
-                if self.spins[i, j] == 1:
-                    self.spins[i, j] = -1
-                else:
-                    self.spins[i, j] = 1
+        # Step 3: Acceptance of the flip, dE = 2 s (J nn + B) looked up in the table -- the spin is written only if accepted
+        P = self.table[(s + 1) // 2, (nn + 4) // 2]
+        if P >= 1 or self.rng.random() < P:
+            self.spins[i, j] = -s
+            self.bonds -= 2 * int(s * nn)
+            self.M -= 2 * int(s)
+
+
+    def sweep(self):   # update the whole grid at once, one sublattice at a time
+        if self.n % 2:
+            raise ValueError('Checkerboard sweep needs an even grid size (periodic boundaries)')
+
+        for mask in self.sublattices:
+            # Step 1: Neighbour sums for all spins in one pass (periodic boundary conditions via np.roll)
+            neighbour_sum = np.roll(self.spins, 1, axis=0) + np.roll(self.spins, -1, axis=0)\
+                          + np.roll(self.spins, 1, axis=1) + np.roll(self.spins, -1, axis=1)
+
+            # Step 2: Acceptance probabilities of flipping every spin of the sublattice
+            s = self.spins[mask]
+            nn = neighbour_sum[mask]
+            P = self.table[(s + 1) // 2, (nn + 4) // 2]
+
+            # Step 3: Accept or reject the whole sublattice with one vector of uniform draws
+            accepted = self.rng.random(s.size) < P
+            self.spins[mask] = np.where(accepted, -s, s)
+
+            # Step 4: Update running totals with the accepted flips only
+            s_flipped = s[accepted]
+            self.bonds -= 2 * int(np.sum(s_flipped * nn[accepted]))
+            self.M -= 2 * int(np.sum(s_flipped))
+
+
+    def wolff_step(self):   # Wolff single-cluster update, grown layer by layer with vectorised bond tests
+        if self.J <= 0:
+            raise ValueError('Cluster updates need a ferromagnetic coupling J > 0')
+        n = self.n
+        p_add = 1 - np.exp(-2 * self.b * self.J)
+
+        # Step 1: Seed the cluster with a random spin
+        i = self.rng.integers(0, n)
+        j = self.rng.integers(0, n)
+        s = self.spins[i, j]
+        self.in_cluster[i, j] = True
+        layer_i, layer_j = np.array([i]), np.array([j])
+        cluster_i, cluster_j = [layer_i], [layer_j]
+
+        # Step 2: Grow it -- every bond from the newest layer to an aligned spin outside is activated with probability p_add
+        while layer_i.size:
+            ni = np.concatenate(((layer_i - 1) % n, (layer_i + 1) % n, layer_i, layer_i))
+            nj = np.concatenate((layer_j, layer_j, (layer_j - 1) % n, (layer_j + 1) % n))
+            added = ~self.in_cluster[ni, nj] & (self.spins[ni, nj] == s) & (self.rng.random(ni.size) < p_add)
+            layer_i, layer_j = np.divmod(np.unique(ni[added] * n + nj[added]), n)   # a site can be reached through several bonds
+            self.in_cluster[layer_i, layer_j] = True
+            cluster_i.append(layer_i)
+            cluster_j.append(layer_j)
+        ci, cj = np.concatenate(cluster_i), np.concatenate(cluster_j)
+
+        # Step 3: Sum of the spins bordering the cluster -- only these bonds change when it flips
+        ni = np.concatenate(((ci - 1) % n, (ci + 1) % n, ci, ci))
+        nj = np.concatenate((cj, cj, (cj - 1) % n, (cj + 1) % n))
+        outside = ~self.in_cluster[ni, nj]
+        boundary = int(np.sum(self.spins[ni[outside], nj[outside]]))
+        self.in_cluster[ci, cj] = False
+
+        # Step 4: Flip the whole cluster with the Metropolis probability of its field energy 2 B s |C|
+        dE_field = 2 * self.B * s * ci.size
+        if dE_field <= 0 or self.rng.random() < np.exp(-self.b * dE_field):
+            self.spins[ci, cj] = -s
+            self.bonds -= 2 * int(s) * boundary
+            self.M -= 2 * int(s) * ci.size
+        return ci.size
+
+
+    def wolff_sweep(self, n_clusters=1):   # a fixed number of clusters -- a state-dependent stopping rule would bias the samples
+        for _ in range(n_clusters):
+            self.wolff_step()
+
+
+    def swendsen_wang_step(self):   # Swendsen-Wang update, clusters labelled by connected components of the active bonds
+        if self.J <= 0:
+            raise ValueError('Cluster updates need a ferromagnetic coupling J > 0')
+        n = self.n
+        p_add = 1 - np.exp(-2 * self.b * self.J)
+
+        # Step 1: Activate bonds between aligned right and down neighbours with probability p_add
+        site = np.arange(n * n).reshape((n, n))
+        rows, cols = [], []
+        for axis in (0, 1):
+            active = (self.spins == np.roll(self.spins, -1, axis=axis)) & (self.rng.random((n, n)) < p_add)
+            rows.append(site[active])
+            cols.append(np.roll(site, -1, axis=axis)[active])
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        graph = coo_matrix((np.ones(rows.size, dtype=np.int8), (rows, cols)), shape=(n * n, n * n))
+        n_clusters, labels = connected_components(graph, directed=False)
+
+        # Step 2: New spin of every cluster from its field heat bath, P(+1) = 1 / (1 + exp(-2 b B |C|))
+        size = np.bincount(labels, minlength=n_clusters)
+        new_spin = np.where(self.rng.random(n_clusters) < expit(2 * self.b * self.B * size), 1, -1)
+        self.spins[...] = new_spin[labels].reshape((n, n))
+
+        # Step 3: O(N) anyway, so the running totals are simply recounted
+        self.bonds = self.calc_bonds(self.spins)
+        self.M = int(np.sum(self.spins))
 
 
     def calc_local_energy(self, i, j):   # calculate only local energy changes
@@ -85,6 +197,97 @@ class Ising:
         return 1 / (n * n) * np.sum(spins)
 
 
+    def calc_bonds(self, spins):   # sum of s_i s_j over all nearest-neighbour bonds
+        return int(np.sum(spins * (np.roll(spins, 1, axis=0) + np.roll(spins, 1, axis=1))))
+
+
+    def snapshot(self, step=1):   # grid for snapshots, every step-th row and column
+        return self.spins[::step, ::step]
+
+
+    def state(self):   # everything needed to continue the run bit-exactly
+        return {'spins': self.spins, 'bonds': self.bonds, 'M': self.M, 'rng': generator_state(self.rng)}
+
+
+    def restore(self, state):
+        self.spins[...] = state['spins']
+        self.bonds = int(state['bonds'])
+        self.M = int(state['M'])
+        restore_generator(self.rng, state['rng'])
+
+
+    def check(self):   # debug mode -- compare running totals with a full recomputation
+        E = self.calc_whole_energy(self.spins, self.J, self.B)
+        M = int(np.sum(self.spins))
+        if not np.isclose(self.E, E) or self.M != M:
+            raise RuntimeError(f'Running totals drifted: E = {self.E} (expected {E}), M = {self.M} (expected {M})')
+
+
+class PackedIsing(Ising):   # one bit per spin in uint64 words, updated with multispin-coded checkerboard sweeps
+
+    def __init__(self, n, rho, J, B, b, S, seed=None):
+        self.n = int(n)
+        self.rho = float(rho)
+        self.J = float(J)
+        self.B = float(B)
+        self.b = float(b)
+        self.S = int(S)
+        self.rng = np.random.default_rng(seed)
+
+        self.words = multispin.random_lattice(self.n, self.rho, self.rng)   # every spin is +1 with probability rho
+
+        # Running totals, updated from the accepted flips of every sweep
+        self.bonds = multispin.bonds(self.words)
+        self.M = multispin.spin_sum(self.words)
+
+
+    @property
+    def spins(self):   # unpacked +-1 grid, built on demand (8x the packed memory)
+        return multispin.unpack(self.words)
+
+
+    def sweep(self):   # N spin flip attempts, 64 spins per bitwise operation
+        d_bonds, d_M = multispin.checkerboard_sweep(self.words, self.J, self.B, self.b, self.rng)
+        self.bonds += d_bonds
+        self.M += d_M
+
+
+    # Single-spin and cluster updates would write to the unpacked copy returned by `spins` and be lost -- refuse them
+    def unsupported(self, name):
+        raise TypeError(f'PackedIsing.{name}() is not available -- the bit-packed grid only runs Metropolis checkerboard sweeps, use Ising instead')
+
+
+    def mc_step(self):
+        self.unsupported('mc_step')
+
+
+    def wolff_step(self):
+        self.unsupported('wolff_step')
+
+
+    def wolff_sweep(self, n_clusters=1):
+        self.unsupported('wolff_sweep')
+
+
+    def swendsen_wang_step(self):
+        self.unsupported('swendsen_wang_step')
+
+
+    def snapshot(self, step=1):   # unpack only the rows and columns that are kept
+        return multispin.unpack(self.words, step)
+
+
+    def state(self):
+        return {'words': self.words, 'bonds': self.bonds, 'M': self.M, 'rng': generator_state(self.rng)}
+
+
+    def restore(self, state):
+        self.words[...] = state['words']
+        self.bonds = int(state['bonds'])
+        self.M = int(state['M'])
+        restore_generator(self.rng, state['rng'])
+
+
 def main():
     parser = argparse.ArgumentParser(description='This is a script for a 2D Ising grid')
     parser.add_argument('-s', '--size', help='Size n of the Ising n x n grid', type=int)
@@ -96,53 +299,112 @@ def main():
     parser.add_argument('-p', '--prefix', help='Pillow images prefix', type=str)
     parser.add_argument('-a', '--animation', help='Pillow animation filename', type=str)
     parser.add_argument('-m', '--magnetisation', help='Filename with magnetisation data', type=str)
+    parser.add_argument('--stride', help='Save a grid snapshot every stride macrosteps', type=int, default=1)
+    parser.add_argument('--downsample', help='Keep every downsample-th row and column of the grid in snapshots', type=int, default=1)
+    parser.add_argument('-E', '--energy', help='Filename with energy data', type=str, default='energy')
+    parser.add_argument('-f', '--format', help='Observable file format -- tab-separated text or binary NumPy (memory-mapped)', choices=['txt', 'npy'], default='txt')
+    parser.add_argument('--flush', help='Number of macrosteps buffered before observables are written out', type=int, default=1024)
+    parser.add_argument('-k', '--check', help='Debug mode -- verify running energy and magnetisation against a full recomputation every k macrosteps',
+                        type=int, default=0)
+    parser.add_argument('-A', '--algorithm', help='Monte Carlo dynamics -- single-spin Metropolis or Wolff / Swendsen-Wang cluster updates (ferromagnetic J > 0)',
+                        choices=['metropolis', 'wolff', 'swendsen-wang'], default='metropolis')
+    parser.add_argument('--clusters', help='Number of Wolff cluster updates per macrostep', type=int, default=1)
+    parser.add_argument('-e', '--engine', help='Metropolis engine -- whole-lattice checkerboard sweeps (even size), bit-packed multispin checkerboard sweeps '
+                        '(size a multiple of 64, 1 bit per spin) or random-site sequential flips (any size, reference)',
+                        choices=['checkerboard', 'multispin', 'sequential'], default='checkerboard')
+    parser.add_argument('--seed', help='RNG seed for a reproducible run', type=int)
+    parser.add_argument('--checkpoint', help='Checkpoint filename (.npz with the grid, RNG state, step and running totals)', type=str)
+    parser.add_argument('--checkpoint-every', help='Save a checkpoint every k macrosteps', type=int, default=100)
+    parser.add_argument('--resume', help='Continue the run saved in --checkpoint bit-exactly (the animation restarts from the resumed step)', action='store_true')
+    parser.add_argument('--profile', help='Time the update, energy and snapshot code paths and print a report at the end', action='store_true')
+    parser.add_argument('--profile-output', help='Also save the profiling report to {profile_output}.json', type=str)
     args = parser.parse_args()
 
-    model = Ising(args.size, args.rho, args.J_value, args.B_value, args.beta_value, args.steps)
+    if args.algorithm != 'metropolis' and args.J_value <= 0:
+        parser.error('cluster updates need a ferromagnetic coupling J > 0')
+    if args.engine == 'multispin' and (args.algorithm != 'metropolis' or args.size % 64):
+        parser.error('the multispin engine runs Metropolis sweeps on grids whose size is a multiple of 64')
+    if args.engine == 'checkerboard' and args.algorithm == 'metropolis' and args.size % 2:
+        parser.error('the checkerboard engine needs an even grid size (periodic boundaries) -- use --engine sequential for odd sizes')
+
+    if args.resume and not args.checkpoint:
+        parser.error('--resume needs the --checkpoint filename')
+
+    if args.engine == 'multispin':
+        model = PackedIsing(args.size, args.rho, args.J_value, args.B_value, args.beta_value, args.steps, args.seed)
+    else:
+        model = Ising(args.size, args.rho, args.J_value, args.B_value, args.beta_value, args.steps, args.seed)
+
+    # Continue from a checkpoint -- the run must have the same grid, couplings and dynamics
+    params = np.array([args.size, args.J_value, args.B_value, args.beta_value, args.clusters])
+    first = 0
+    if args.resume:
+        state = load_checkpoint(f'{args.checkpoint}.npz')
+        if not np.array_equal(state['params'], params) or str(state['engine']) != args.engine or str(state['algorithm']) != args.algorithm:
+            parser.error('the checkpoint was written with a different -s/-J/-B/-b/--engine/--algorithm/--clusters')
+        model.restore(state)
+        first = int(state['step'])
+
+    # Buffered observable files, written in chunks of --flush macrosteps
+    energy_writer = ObservableWriter(f'{args.energy}.{args.format}', args.steps, args.flush, first)
+    magnetisation_writer = ObservableWriter(f'{args.magnetisation}.{args.format}', args.steps, args.flush, first) if args.magnetisation else None
 
-    open(f'{args.magnetisation}.txt', 'w').close()   # clear the file for new magnetisation data
-    open('energy.txt', 'w').close()   # clear the file for new energy data
+    # Grid snapshots are encoded in a background thread, the animation is streamed frame by frame
+    snapshots = SnapshotWriter(args.prefix, args.animation, args.stride, args.downsample)
+
+    # Profiling -- the instance methods are wrapped only when asked for, so a normal run pays nothing
+    if args.profile or args.profile_output:
+        for method in ('mc_step', 'sweep', 'wolff_sweep', 'swendsen_wang_step', 'calc_whole_energy', 'snapshot'):
+            setattr(model, method, instrument(getattr(model, method), name=method))
+        snapshots.submit = instrument(snapshots.submit, name='snapshots.submit')
+        snapshots.encode = instrument(snapshots.encode, name='snapshots.encode')   # background thread
 
     # Simulation loop
     start = time.time()
-    for i in track(range(args.steps), description='⚛️  [bold magenta]2D Ising Simulation in progress...[/bold magenta] ⚛️  '):   # macrostepping
-        for j in range(args.size * args.size):   # microstepping
-            model.mc_step()
-
-        # Save grid states each macrostep
-        if not args.prefix:
-            pass
+    for i in track(range(first, args.steps), description='⚛️  [bold magenta]2D Ising Simulation in progress...[/bold magenta] ⚛️  '):   # macrostepping
+        if args.algorithm == 'wolff':
+            model.wolff_sweep(args.clusters)
+        elif args.algorithm == 'swendsen-wang':
+            model.swendsen_wang_step()
+        elif args.engine in ('checkerboard', 'multispin'):
+            model.sweep()   # N spin flip attempts in two vectorised sublattice updates
         else:
-            pixel_array = np.where(model.spins == 1, 255, 0).astype(np.uint8)
-            img = Image.fromarray(pixel_array, mode='L')
-            img.save(f'{args.prefix}{i}.png')
+            for j in range(args.size * args.size):   # microstepping
+                model.mc_step()
+
+        if args.check and (i + 1) % args.check == 0:
+            model.check()   # running totals vs full recomputation
+
+        # Save grid states every stride macrosteps
+        snapshots.submit(i, model.snapshot)
 
         # Save magnetisation data each macrostep
         if not args.magnetisation:
             pass
         else:
-            with open(f'{args.magnetisation}.txt', 'a') as f:
-                f.write(f'{i}\t{model.calc_magnetisation(args.size, model.spins)}\n')   # append magnetisation data
+            magnetisation_writer.append(1 / (args.size * args.size) * model.M)
 
         # Save energy data each macrostep
-        with open('energy.txt', 'a') as f:
-            f.write(f'{i}\t{model.calc_whole_energy(model.spins, args.J_value, args.B_value)}\n')   # append energy data
-    end = time.time()
-    print(f'Time: {end - start} s')
+        energy_writer.append(model.E)
 
-    # Create animation out of saved grid states
-    if not args.animation:
-        pass
-    else:
-        frames = [Image.open(img) for img in sorted(glob.glob('image_*.png'))]   # load all saved frames and sort by index
+        # Save a checkpoint every --checkpoint-every macrosteps and at the end
+        if args.checkpoint and ((i + 1) % args.checkpoint_every == 0 or i + 1 == args.steps):
+            energy_writer.flush()   # observable files match the checkpoint
+            if magnetisation_writer:
+                magnetisation_writer.flush()
+            save_checkpoint(f'{args.checkpoint}.npz', step=i + 1, params=params, engine=args.engine, algorithm=args.algorithm, **model.state())
 
-        frames[0].save(
-            f'{args.animation}.gif',
-            save_all=True,
-            append_images=frames[1:],  # append remaining frames
-            duration=200,              # time between frames in ms
-            loop=0                     # 0 = loop forever
-        )
+    snapshots.close()   # wait for the queued snapshots to be written
+    energy_writer.close()   # flush the remaining buffered data
+    if magnetisation_writer:
+        magnetisation_writer.close()
+    end = time.time()
+    print(f'Time: {end - start} s')
+    if args.profile or args.profile_output:
+        print(report())
+    if args.profile_output:
+        save_report(f'{args.profile_output}.json')
 
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
\ No newline at end of file
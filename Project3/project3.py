@@ -1,30 +1,32 @@
-import time
+import argparse
+import sys
+from pathlib import Path
 import numpy as np
 
-def my_decorator(function):
-    times = []   # an array to store times
-    def wrapper(*args, **kwargs):
-        start = time.time()
-        result = function(*args, **kwargs)  # call the decorated function
-        end = time.time()
-        times.append(end - start)
-        return result
-    
-    def get_stats():
-        print(np.round(sorted(times), 3))
-        return f'Mean: {np.round(np.mean(times), 3)}, std: {np.round(np.std(times), 3)}, min: {np.round(np.min(times), 3)}, max: {np.round(np.max(times), 3)}, median: {np.round(np.median(times), 3)}'
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))   # make the shared 'common' package importable
+from common.instrumentation import instrument, report
 
-    wrapper.get_stats = get_stats   # set an attribute to a wrapper
-    return wrapper
+def my_decorator(function=None, **options):   # timing decorator, now backed by the shared instrumentation registry
+    return instrument(function, **options)
 
-@my_decorator
+@my_decorator(name='my_function', warmup=1, cpu=True, memory=True)
 def my_function():
     A = np.random.rand(1000, 1000)
     B = np.random.rand(1000, 1000)
     C = np.dot(A, B)
     return C
 
-for i in range(10):
-    my_function()
+def main():
+    parser = argparse.ArgumentParser(description='This is a script for a timing decorator')
+    parser.add_argument('-n', '--calls', help='Number of calls of the decorated function', type=int, default=10)
+    parser.add_argument('-j', '--json', help='Print the report of all instrumented functions as JSON', action='store_true')
+    args = parser.parse_args()
 
-print(my_function.get_stats())
\ No newline at end of file
+    for i in range(args.calls):
+        my_function()
+
+    print(my_function.get_stats())
+    print(report('json' if args.json else 'table'))
+
+if __name__ == '__main__':
+    main()
@@ -1,67 +1,63 @@
 import argparse
+import sys
+from pathlib import Path
 import numpy as np
-from PIL import Image
-import glob
 from rich.progress import track
 import numba
 import time
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+try:
+    from numba import _helperlib   # private -- only used for the RNG state stored in checkpoints
+except ImportError:
+    _helperlib = None
 
-parser = argparse.ArgumentParser(description='This is a script for a 2D Ising grid')
-parser.add_argument('-s', '--size', help='Size n of the Ising n x n grid', type=int)
-parser.add_argument('-r', '--rho', help='Density of spins', type=float, default=0.5)
-parser.add_argument('-J', '--J_value', help='Exchange coupling', type=float)
-parser.add_argument('-B', '--B_value', help='External magnetic field', type=float)
-parser.add_argument('-b', '--beta_value', help='Temperature -- beta = 1 / (k_B T)', type=float)
-parser.add_argument('-S', '--steps', help='Number of simulation steps', type=int)
-parser.add_argument('-p', '--prefix', help='Pillow images prefix', type=str)
-parser.add_argument('-a', '--animation', help='Pillow animation filename', type=str)
-parser.add_argument('-m', '--magnetisation', help='Filename with magnetisation data', type=str)
-args = parser.parse_args()
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))   # make the shared 'common' package importable
+from common.metropolis import acceptance_table
+from common.observables import ObservableWriter
+from common.snapshots import SnapshotWriter
+from common.instrumentation import instrument, report, save_report
+from common.checkpoint import save_checkpoint, load_checkpoint
+
+acceptance_table_jit = numba.njit(cache=True)(acceptance_table)   # the same table builder, callable from the kernels
+
+ALGORITHMS = {'metropolis': 0, 'wolff': 1, 'swendsen-wang': 2}   # dynamics codes understood by the kernels
+METROPOLIS, WOLFF, SWENDSEN_WANG = 0, 1, 2
+
+DI = (-1, 1, 0, 0)   # offsets of the 4 nearest neighbours
+DJ = (0, 0, -1, 1)
 
 # Initialise the Ising grid
-@numba.njit
+@numba.njit(cache=True)
 def spins(n, rho):
     N = n * n   # total number of spins
     N_plus = int(rho * N)   # number of +1 spins
     N_minus = N - N_plus   # number of -1 spins
-    spins_init = np.array([1] * N_plus + [-1] * N_minus)
+    spins_init = np.ones(N, dtype=np.int8)   # 1 byte per spin
+    spins_init[N_plus:] = -1
     np.random.shuffle(spins_init)   # randomise spin distribution
     spins = spins_init.reshape((n, n))
     return spins
 
-@numba.njit
-def mc_step(n, spins, J, B, b):
-    # Step 1: Choose a random spin and calculate energy before flipping
+@numba.njit(cache=True)
+def mc_step(n, spins, table):
+    # Step 1: Choose a random spin
     i = np.random.randint(0, n)
     j = np.random.randint(0, n)
-    E_before = calc_local_energy(i, j, n, spins, J, B)
-
-    # Step 2: Flip its value and calculate energy after it
-    if spins[i, j] == 1:
-        spins[i, j] = -1
-    else:
-        spins[i, j] = 1
-    E_after = calc_local_energy(i, j, n, spins, J, B)
-
-    # Step 3: Calculate energy difference
-    dE = E_after - E_before
-
-    # Step 4: Acceptance of the random spin
-    if dE < 0:
-        pass
-    else:
-        p = np.random.uniform()
-        P = np.exp(-b * dE)
-        if p < P:
-            pass
-        else:
-            if spins[i, j] == 1:
-                spins[i, j] = -1
-            else:
-                spins[i, j] = 1
+    s = spins[i, j]
+
+    # Step 2: Sum its 4 nearest neighbours (% n creates boundary conditions)
+    nn = spins[(i-1) % n, j] + spins[(i+1) % n, j] + spins[i, (j-1) % n] + spins[i, (j+1) % n]
+
+    # Step 3: Acceptance of the flip, dE = 2 s (J nn + B) looked up in the table -- the spin is written only if accepted
+    P = table[(s + 1) // 2, (nn + 4) // 2]
+    if P >= 1 or np.random.uniform(0, 1) < P:
+        spins[i, j] = -s
+        return -2 * s * nn, -2 * s   # changes of the bond sum and of the spin sum
+    return 0, 0
 
 # Calculate energy for MC microstepping
-@numba.njit
+@numba.njit(cache=True)
 def calc_local_energy(i, j, n, spins, J, B):   # calculate only local energy changes
     up    = spins[(i-1) % n, j]   # % n creates boundary conditions
     down  = spins[(i+1) % n, j]
@@ -72,7 +68,7 @@ def calc_local_energy(i, j, n, spins, J, B):   # calculate only local energy cha
     E_field = -B * spins[i, j]   # external field energy
     return E_int + E_field
 
-@numba.njit
+@numba.njit(cache=True)
 def calc_whole_energy(n, spins, J, B):   # calculate energy changes for the whole grid
     E_int = 0
     E_field = 0
@@ -86,53 +82,384 @@ def calc_whole_energy(n, spins, J, B):   # calculate energy changes for the whol
             E_field += -B * spins[i, j]   # external field term
     return E_int + E_field
     
-@numba.njit 
+@numba.njit(cache=True)
 def calc_magnetisation(n, spins):
     return 1 / (n * n) * np.sum(spins)
 
+@numba.njit(cache=True)
+def calc_bonds(n, spins):   # sum of s_i s_j over all nearest-neighbour bonds, E = -J * bonds - B * sum(spins)
+    bonds = 0
+    for i in range(n):
+        for j in range(n):
+            bonds += spins[i, j] * (spins[i, (j+1) % n] + spins[(i+1) % n, j])
+    return bonds
+
+
+# Do n_micro Metropolis microsteps natively, without returning to Python between them
+@numba.njit(cache=True)
+def sweep(spins, n_micro, J, B, b):
+    n = spins.shape[0]
+    table = acceptance_table_jit(J, B, b)
+    d_bonds = 0
+    d_M = 0
+    for _ in range(n_micro):   # microstepping
+        db, dm = mc_step(n, spins, table)
+        d_bonds += db
+        d_M += dm
+    return d_bonds, d_M
+
+# Wolff single-cluster update -- grow a cluster of aligned spins with bond probability p_add = 1 - exp(-2 b J)
+# from an array-based queue, then flip it with the Metropolis probability of its field energy 2 B s |C|
+@numba.njit(cache=True)
+def wolff_step(spins, J, B, b, cluster, in_cluster):
+    n = spins.shape[0]
+    p_add = 1 - np.exp(-2 * b * J)
+
+    # Step 1: Seed the cluster with a random spin
+    i = np.random.randint(0, n)
+    j = np.random.randint(0, n)
+    s = spins[i, j]
+    cluster[0] = i * n + j
+    in_cluster[i, j] = True
+    size = 1
+
+    # Step 2: Grow it breadth-first, every bond to an aligned neighbour is activated with probability p_add
+    head = 0
+    while head < size:
+        i = cluster[head] // n
+        j = cluster[head] % n
+        head += 1
+        for k in range(4):
+            x = (i + DI[k]) % n
+            y = (j + DJ[k]) % n
+            if not in_cluster[x, y] and spins[x, y] == s and np.random.uniform(0, 1) < p_add:
+                in_cluster[x, y] = True
+                cluster[size] = x * n + y
+                size += 1
+
+    # Step 3: Sum of the spins bordering the cluster -- only these bonds change when it flips
+    boundary = 0
+    for c in range(size):
+        i = cluster[c] // n
+        j = cluster[c] % n
+        for k in range(4):
+            x = (i + DI[k]) % n
+            y = (j + DJ[k]) % n
+            if not in_cluster[x, y]:
+                boundary += spins[x, y]
+
+    # Step 4: Flip the whole cluster if the field allows it, then clear the cluster marks
+    dE_field = 2 * B * s * size
+    accepted = dE_field <= 0 or np.random.uniform(0, 1) < np.exp(-b * dE_field)
+    for c in range(size):
+        i = cluster[c] // n
+        j = cluster[c] % n
+        in_cluster[i, j] = False
+        if accepted:
+            spins[i, j] = -s
+
+    if accepted:
+        return size, -2 * s * boundary, -2 * s * size   # cluster size, changes of the bond sum and of the spin sum
+    return size, 0, 0
+
+# Do a fixed number of Wolff cluster updates -- stopping after a state-dependent number of visited spins would bias the samples
+@numba.njit(cache=True)
+def wolff_sweep(spins, J, B, b, n_clusters):
+    n = spins.shape[0]
+    cluster = np.empty(n * n, dtype=np.int64)   # queue of cluster sites
+    in_cluster = np.zeros((n, n), dtype=np.bool_)
+    d_bonds = 0
+    d_M = 0
+    for _ in range(n_clusters):
+        size, db, dm = wolff_step(spins, J, B, b, cluster, in_cluster)
+        d_bonds += db
+        d_M += dm
+    return d_bonds, d_M
+
+@numba.njit(cache=True)
+def find(parent, x):   # union-find root with path halving
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+# Swendsen-Wang update -- activate bonds between aligned neighbours with probability p_add = 1 - exp(-2 b J),
+# join them with an array-based union-find and give every cluster a new spin from its field heat bath
+@numba.njit(cache=True)
+def swendsen_wang_step(spins, J, B, b):
+    n = spins.shape[0]
+    N = n * n
+    p_add = 1 - np.exp(-2 * b * J)
+
+    # Step 1: Clusters of sites joined by active bonds (right and down neighbours cover every bond once)
+    parent = np.arange(N)
+    for i in range(n):
+        for j in range(n):
+            for k in range(2):
+                x = (i + k) % n
+                y = (j + 1 - k) % n
+                if spins[i, j] == spins[x, y] and np.random.uniform(0, 1) < p_add:
+                    root_a = find(parent, i * n + j)
+                    root_b = find(parent, x * n + y)
+                    if root_a != root_b:
+                        parent[root_a] = root_b
+
+    # Step 2: New spin of every cluster, P(+1) = 1 / (1 + exp(-2 b B |C|))
+    size = np.zeros(N, dtype=np.int64)
+    for site in range(N):
+        size[find(parent, site)] += 1
+    new_spin = np.zeros(N, dtype=spins.dtype)
+    for site in range(N):
+        if size[site] > 0:   # cluster root
+            new_spin[site] = 1 if np.random.uniform(0, 1) < 1 / (1 + np.exp(-2 * b * B * size[site])) else -1
+
+    # Step 3: Assign the new cluster spins
+    for site in range(N):
+        spins[site // n, site % n] = new_spin[find(parent, site)]
+
+# Do n_macro macrosteps from running totals (bonds, M) and fill the preallocated energy and magnetisation arrays after each of them
+@numba.njit(cache=True)
+def run(spins, n_macro, J, B, b, bonds, M, energy, magnetisation, algorithm=METROPOLIS, n_clusters=1):
+    n = spins.shape[0]
+    for i in range(n_macro):   # macrostepping
+        if algorithm == WOLFF:
+            d_bonds, d_M = wolff_sweep(spins, J, B, b, n_clusters)
+        elif algorithm == SWENDSEN_WANG:
+            swendsen_wang_step(spins, J, B, b)   # O(N) anyway, so the totals are simply recounted
+            d_bonds = calc_bonds(n, spins) - bonds
+            d_M = np.sum(spins) - M
+        else:
+            d_bonds, d_M = sweep(spins, n * n, J, B, b)
+        bonds += d_bonds
+        M += d_M
+        energy[i] = -J * bonds - B * M   # O(1) instead of a full-grid recomputation
+        magnetisation[i] = 1 / (n * n) * M
+    return bonds, M
+
+
+# Debug mode -- compare running totals with a full recomputation
+def check(n, spins, J, B, bonds, M):
+    E = calc_whole_energy(n, spins, J, B)
+    if not np.isclose(-J * bonds - B * M, E) or M != np.sum(spins):
+        raise RuntimeError(f'Running totals drifted: E = {-J * bonds - B * M} (expected {E}), M = {M} (expected {np.sum(spins)})')
+
+
+# Seed numba's random state (independent of NumPy's global one) in the current process
+@numba.njit(cache=True)
+def seed(s):
+    np.random.seed(s)
+
+# numba's MT19937 state of the current thread as (position, key) -- stored in checkpoints for bit-exact restarts
+# (numba keeps it in its internal helper library, the kernels never draw normals so there is no cached Gaussian to save)
+def rng_state_supported():
+    return all(hasattr(_helperlib, name) for name in ('rnd_get_np_state_ptr', 'rnd_get_state', 'rnd_set_state'))
+
+def check_rng_state():
+    if not rng_state_supported():
+        raise RuntimeError(f'checkpoints need the RNG state from numba internals, which numba {numba.__version__} does not provide')
+
+def get_rng_state():
+    check_rng_state()
+    position, key = _helperlib.rnd_get_state(_helperlib.rnd_get_np_state_ptr())
+    return position, np.array(key, dtype=np.uint32)
+
+def set_rng_state(position, key):
+    check_rng_state()
+    _helperlib.rnd_set_state(_helperlib.rnd_get_np_state_ptr(), (int(position), [int(k) for k in key]))
+
+
+# Parse a sweep value -- a single number or an inclusive range 'start:stop:num'
+def parse_values(text):
+    if ':' in text:
+        start, stop, num = text.split(':')
+        return list(np.linspace(float(start), float(stop), int(num)))
+    return [float(text)]
+
+
+# Run one independent chain and return its energy and magnetisation after every sampled macrostep
+def run_chain(n, rho, J, B, b, thermalisation, steps, chain_seed, algorithm=METROPOLIS, n_clusters=1):
+    seed(chain_seed)   # every chain gets its own RNG stream
+    grid = spins(n, rho)
+    bonds, M = calc_bonds(n, grid), np.sum(grid)
+    bonds, M = run(grid, thermalisation, J, B, b, bonds, M, np.empty(thermalisation), np.empty(thermalisation), algorithm, n_clusters)   # discarded macrosteps
+
+    energy = np.empty(steps)
+    magnetisation = np.empty(steps)
+    run(grid, steps, J, B, b, bonds, M, energy, magnetisation, algorithm, n_clusters)
+    return energy, magnetisation
+
+
+# Per-chain estimates of <E>, <M>, <|M|>, susceptibility and specific heat (per spin)
+def chain_observables(n, b, energy, magnetisation):
+    N = n * n
+    e = energy / N
+    return np.array([
+        np.mean(e),
+        np.mean(magnetisation),
+        np.mean(np.abs(magnetisation)),
+        b * N * np.var(magnetisation),   # chi = b N (<m^2> - <m>^2)
+        b * b * N * np.var(e),   # C = b^2 (<E^2> - <E>^2) / N
+    ])
+
+
+# Run independent chains for every (J, B, beta) point in parallel and write one results table
+def run_sweep(args):
+    couplings = [J for values in (args.couplings or [[args.J_value]]) for J in values]
+    fields = [B for values in (args.fields or [[args.B_value]]) for B in values]
+    betas = [b for values in (args.betas or [[args.beta_value]]) for b in values]
+    points = [(J, B, b) for J in couplings for B in fields for b in betas]
+
+    seeds = np.random.SeedSequence(args.seed).spawn(len(points) * args.chains)   # independent RNG streams
+    results = {point: [None] * args.chains for point in points}
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {}
+        for k, point in enumerate(points):
+            J, B, b = point
+            for c in range(args.chains):
+                chain_seed = int(seeds[k * args.chains + c].generate_state(1)[0])
+                future = pool.submit(run_chain, args.size, args.rho, J, B, b, args.thermalisation, args.steps, chain_seed, ALGORITHMS[args.algorithm], args.clusters)
+                futures[future] = (point, c)
+        for future in track(as_completed(futures), total=len(futures), description='⚛️  [bold magenta]2D Ising parameter sweep in progress...[/bold magenta] ⚛️  '):
+            point, c = futures[future]
+            results[point][c] = chain_observables(args.size, point[2], *future.result())   # keep chain order for reproducible averages
+
+    with open(f'{args.sweep}.txt', 'w') as f:
+        f.write('J\tB\tbeta\tchains\tE\tE_err\tM\tM_err\tabs_M\tabs_M_err\tchi\tchi_err\tC\tC_err\n')
+        for J, B, b in points:
+            chains = np.array(results[(J, B, b)])
+            mean = chains.mean(axis=0)
+            err = chains.std(axis=0, ddof=1) / np.sqrt(len(chains)) if len(chains) > 1 else np.full(mean.size, np.nan)   # standard error over chains
+            columns = [f'{m}\t{e}' for m, e in zip(mean, err)]
+            f.write(f'{J}\t{B}\t{b}\t{len(chains)}\t' + '\t'.join(columns) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='This is a script for a 2D Ising grid')
+    parser.add_argument('-s', '--size', help='Size n of the Ising n x n grid', type=int)
+    parser.add_argument('-r', '--rho', help='Density of spins', type=float, default=0.5)
+    parser.add_argument('-J', '--J_value', help='Exchange coupling', type=float)
+    parser.add_argument('-B', '--B_value', help='External magnetic field', type=float)
+    parser.add_argument('-b', '--beta_value', help='Temperature -- beta = 1 / (k_B T)', type=float)
+    parser.add_argument('-S', '--steps', help='Number of simulation steps', type=int)
+    parser.add_argument('-p', '--prefix', help='Pillow images prefix', type=str)
+    parser.add_argument('-a', '--animation', help='Pillow animation filename', type=str)
+    parser.add_argument('-m', '--magnetisation', help='Filename with magnetisation data', type=str)
+    parser.add_argument('--stride', help='Save a grid snapshot every stride macrosteps', type=int, default=1)
+    parser.add_argument('--downsample', help='Keep every downsample-th row and column of the grid in snapshots', type=int, default=1)
+    parser.add_argument('-E', '--energy', help='Filename with energy data', type=str, default='energy')
+    parser.add_argument('-f', '--format', help='Observable file format -- tab-separated text or binary NumPy (memory-mapped)', choices=['txt', 'npy'], default='txt')
+    parser.add_argument('--flush', help='Number of macrosteps buffered before observables are written out', type=int, default=1024)
+    parser.add_argument('-A', '--algorithm', help='Monte Carlo dynamics -- single-spin Metropolis or Wolff / Swendsen-Wang cluster updates (ferromagnetic J > 0)',
+                        choices=list(ALGORITHMS), default='metropolis')
+    parser.add_argument('--clusters', help='Number of Wolff cluster updates per macrostep', type=int, default=1)
+    parser.add_argument('-k', '--check', help='Debug mode -- verify running energy and magnetisation against a full recomputation every k macrosteps', type=int, default=0)
+    parser.add_argument('--sweep', help='Filename for a parameter sweep results table (runs independent chains in parallel instead of a single simulation)', type=str)
+    parser.add_argument('--betas', help='Sweep values of beta -- numbers or inclusive ranges start:stop:num', nargs='+', type=parse_values)
+    parser.add_argument('--fields', help='Sweep values of B -- numbers or inclusive ranges start:stop:num', nargs='+', type=parse_values)
+    parser.add_argument('--couplings', help='Sweep values of J -- numbers or inclusive ranges start:stop:num', nargs='+', type=parse_values)
+    parser.add_argument('-c', '--chains', help='Number of independent chains per sweep point', type=int, default=1)
+    parser.add_argument('-t', '--thermalisation', help='Number of discarded macrosteps before sampling (sweep mode)', type=int, default=0)
+    parser.add_argument('-w', '--workers', help='Number of worker processes (sweep mode)', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', help='RNG seed for a reproducible run (root seed of the independent chain streams in sweep mode)', type=int)
+    parser.add_argument('--checkpoint', help='Checkpoint filename (.npz with the grid, RNG state, step and running totals)', type=str)
+    parser.add_argument('--checkpoint-every', help='Save a checkpoint every k macrosteps', type=int, default=100)
+    parser.add_argument('--resume', help='Continue the run saved in --checkpoint bit-exactly (the animation restarts from the resumed step)', action='store_true')
+    parser.add_argument('--profile', help='Time the macrostep kernel, energy check and snapshot code paths and print a report at the end', action='store_true')
+    parser.add_argument('--profile-output', help='Also save the profiling report to {profile_output}.json', type=str)
+    args = parser.parse_args()
+
+    couplings = [J for values in (args.couplings or [[args.J_value]]) for J in values]
+    if args.algorithm != 'metropolis' and min(couplings) <= 0:
+        parser.error('cluster updates need a ferromagnetic coupling J > 0')
+
+    if args.sweep:
+        start = time.time()
+        run_sweep(args)
+        end = time.time()
+        print(f'Time: {end - start} s')
+        return
+
+    if args.resume and not args.checkpoint:
+        parser.error('--resume needs the --checkpoint filename')
+    if args.checkpoint and not rng_state_supported():   # fail before the run, not at the first checkpoint
+        parser.error(f'--checkpoint needs the RNG state from numba internals, which numba {numba.__version__} does not provide')
+
+    seed(int(np.random.SeedSequence(args.seed).generate_state(1)[0]))   # fresh entropy unless --seed is given
+    grid = spins(args.size, args.rho)
+    algorithm = ALGORITHMS[args.algorithm]
+    energy = np.empty(1)   # observables after the macrostep, filled by the kernel
+    magnetisation = np.empty(1)
+    bonds, M = calc_bonds(args.size, grid), np.sum(grid)   # running totals carried between kernel calls
+
+    # Continue from a checkpoint -- the run must have the same grid, couplings and dynamics
+    params = np.array([args.size, args.J_value, args.B_value, args.beta_value, args.clusters])
+    first = 0
+    if args.resume:
+        state = load_checkpoint(f'{args.checkpoint}.npz')
+        if not np.array_equal(state['params'], params) or str(state['algorithm']) != args.algorithm:
+            parser.error('the checkpoint was written with a different -s/-J/-B/-b/--algorithm/--clusters')
+        grid[...] = state['spins']
+        bonds, M = int(state['bonds']), int(state['M'])
+        set_rng_state(state['rng_position'], state['rng_key'])
+        first = int(state['step'])
+
+    # Buffered observable files, written in chunks of --flush macrosteps
+    energy_writer = ObservableWriter(f'{args.energy}.{args.format}', args.steps, args.flush, first)
+    magnetisation_writer = ObservableWriter(f'{args.magnetisation}.{args.format}', args.steps, args.flush, first) if args.magnetisation else None
+
+    # Grid snapshots are encoded in a background thread, the animation is streamed frame by frame
+    snapshots = SnapshotWriter(args.prefix, args.animation, args.stride, args.downsample)
+
+    # Profiling -- the single-spin steps run inside the native kernel, so the whole macrostep call is timed
+    # (the first calls, which may compile the kernels, are kept out of the statistics)
+    macrostep, verify = run, check
+    if args.profile or args.profile_output:
+        macrostep = instrument(run, name='run', warmup=1)
+        verify = instrument(check, name='check (calc_whole_energy)', warmup=1)
+        snapshots.submit = instrument(snapshots.submit, name='snapshots.submit')
+        snapshots.encode = instrument(snapshots.encode, name='snapshots.encode')   # background thread
+
+    # Simulation loop
+    start = time.time()
+    for i in track(range(first, args.steps), description='⚛️  [bold magenta]2D Ising Simulation in progress...[/bold magenta] ⚛️  '):   # macrostepping
+        bonds, M = macrostep(grid, 1, args.J_value, args.B_value, args.beta_value, bonds, M, energy, magnetisation, algorithm, args.clusters)   # all microsteps in one native call
+
+        if args.check and (i + 1) % args.check == 0:
+            verify(args.size, grid, args.J_value, args.B_value, bonds, M)   # running totals vs full recomputation
+
+        # Save grid states every stride macrosteps
+        snapshots.submit(i, grid)
+
+        # Save magnetisation data each macrostep
+        if not args.magnetisation:
+            pass
+        else:
+            magnetisation_writer.append(magnetisation[0])
+
+        # Save energy data each macrostep
+        energy_writer.append(energy[0])
+
+        # Save a checkpoint every --checkpoint-every macrosteps and at the end
+        if args.checkpoint and ((i + 1) % args.checkpoint_every == 0 or i + 1 == args.steps):
+            energy_writer.flush()   # observable files match the checkpoint
+            if magnetisation_writer:
+                magnetisation_writer.flush()
+            position, key = get_rng_state()
+            save_checkpoint(f'{args.checkpoint}.npz', step=i + 1, params=params, algorithm=args.algorithm,
+                            spins=grid, bonds=bonds, M=M, rng_position=position, rng_key=key)
+
+    snapshots.close()   # wait for the queued snapshots to be written
+    energy_writer.close()   # flush the remaining buffered data
+    if magnetisation_writer:
+        magnetisation_writer.close()
+    end = time.time()
+    print(f'Time: {end - start} s')
+    if args.profile or args.profile_output:
+        print(report())
+    if args.profile_output:
+        save_report(f'{args.profile_output}.json')
+
 
-spins = spins(args.size, args.rho)
-
-open(f"{args.magnetisation}.txt", "w").close()   # clear the file for new magnetisation data
-open("energy.txt", "w").close()   # clear the file for new energy data
-
-# Simulation loop
-start = time.time()
-for i in track(range(args.steps), description='⚛️  [bold magenta]2D Ising Simulation in progress...[/bold magenta] ⚛️  '):   # macrostepping
-    for j in range(args.size * args.size):   # microstepping
-        mc_step(args.size, spins, args.J_value, args.B_value, args.beta_value)
-
-    # Save grid states each macrostep
-    if not args.prefix:
-        pass
-    else:
-        pixel_array = np.where(spins == 1, 255, 0).astype(np.uint8)
-        img = Image.fromarray(pixel_array, mode="L")
-        img.save(f"{args.prefix}{i}.png")
-
-    # Save magnetisation data each macrostep
-    if not args.magnetisation:
-        pass
-    else:
-        with open(f"{args.magnetisation}.txt", "a") as f:
-            f.write(f"{i}\t{calc_magnetisation(args.size, spins)}\n")   # append magnetisation data
-
-    # Save energy data each macrostep
-    with open("energy.txt", "a") as f:
-        f.write(f"{i}\t{calc_whole_energy(args.size, spins, args.J_value, args.B_value)}\n")   # append energy data
-end = time.time()
-print(f'Time: {end - start} s')
-
-# Create animation out of saved grid states
-if not args.animation:
-    pass
-else:
-    frames = [Image.open(img) for img in sorted(glob.glob("image_*.png"))]   # load all saved frames and sort by index
-
-    frames[0].save(
-        f"{args.animation}.gif",
-        save_all=True,
-        append_images=frames[1:],  # append remaining frames
-        duration=200,              # time between frames in ms
-        loop=0                     # 0 = loop forever
-    )
\ No newline at end of file
+if __name__ == '__main__':
+    main()
\ No newline at end of file
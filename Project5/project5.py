@@ -1,34 +1,101 @@
 import argparse
-import requests
-from bs4 import BeautifulSoup
+import hashlib
 import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))   # make the shared 'common' package importable
+from common.records import FORMATS, open_sink, parse_int, parse_float
+
+COUNTRIES = SoupStrainer('div', class_='col-md-4 country')   # build the tree only for the country divs
+JSON_KEYS = {'capital': 'Capital', 'population': 'Population', 'area': 'Area (km^2)'}   # keys of the original countries.json
+
+# One pooled session shared by all worker threads, retrying transient failures with exponential backoff
+def make_session(workers, retries):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers,
+                          max_retries=Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504)))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# Fetch a page, revalidating the disk cache (if any) with ETag/Last-Modified so an unchanged page costs a 304
+def fetch(session, url, params=None, timeout=10, cache=None):
+    request = requests.Request('GET', url, params=params).prepare()   # full URL with the page parameter, used as the cache key
+    headers = {}
+    if cache:
+        key = Path(cache) / hashlib.sha256(request.url.encode()).hexdigest()
+        meta = key.with_suffix('.json')
+        if meta.exists() and key.with_suffix('.html').exists():   # revalidate only a complete entry, a 304 needs the stored page
+            validators = json.loads(meta.read_text())
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+    res = session.get(request.url, headers=headers, timeout=timeout)
+    if res.status_code == 304:
+        return key.with_suffix('.html').read_bytes()
+    res.raise_for_status()
 
-parser = argparse.ArgumentParser(description='This is a script for static web-scraping')
-parser.add_argument('-f', '--filename', help='JSON filename to store scraped data')
-args = parser.parse_args()
+    if cache and (res.headers.get('ETag') or res.headers.get('Last-Modified')):
+        key.with_suffix('.html').write_bytes(res.content)
+        meta.write_text(json.dumps({'url': request.url, 'etag': res.headers.get('ETag'), 'last_modified': res.headers.get('Last-Modified')}))
+    return res.content   # raw bytes, the parser picks the encoding from the page itself
 
-url = 'https://www.scrapethissite.com/pages/simple/'   # LEGAL, made for scraping
+# One scraped country, numbers parsed once at scrape time
+@dataclass
+class Country:
+    name: str
+    capital: str
+    population: int
+    area: float   # km^2
 
-res = requests.get(url)
+# Scrape all countries of one page
+def parse_countries(html):
+    soup = BeautifulSoup(html, 'lxml', parse_only=COUNTRIES)
 
-soup = BeautifulSoup(res.text, 'html.parser')
+    for country in soup.find_all('div', class_='col-md-4 country'):
+        name = country.find('h3', class_='country-name').get_text(strip=True)   # scrape country name
+        capital = country.find('span', class_='country-capital').get_text(strip=True)   # scrape country capital
+        population = country.find('span', class_='country-population').get_text(strip=True)   # scrape country population
+        area = country.find('span', class_='country-area').get_text(strip=True)   # scrape country area
 
-countries_data = soup.find_all('div', class_ = 'col-md-4 country')   # fetch a div with all country data
+        yield Country(name, capital, parse_int(population), parse_float(area))
 
-countries = {}   # create an empty dictionary to store countries data
+def main():
+    parser = argparse.ArgumentParser(description='This is a script for static web-scraping')
+    parser.add_argument('-f', '--filename', help='Filename (without extension) to store scraped data')
+    parser.add_argument('-o', '--format', help='Output format (json is keyed by country name, with the keys of the original countries.json)', choices=FORMATS, default='json')
+    parser.add_argument('-u', '--urls', help='Pages to scrape', nargs='+', default=['https://www.scrapethissite.com/pages/simple/'])   # LEGAL, made for scraping
+    parser.add_argument('-p', '--pages', help='Number of pages of each URL to scrape (passed as --page-param=1..N)', type=int, default=1)
+    parser.add_argument('--page-param', help='Query parameter selecting the page', type=str, default='page_num')
+    parser.add_argument('-w', '--workers', help='Maximal number of concurrent requests', type=int, default=8)
+    parser.add_argument('-t', '--timeout', help='Request timeout (s)', type=float, default=10)
+    parser.add_argument('-r', '--retries', help='Retries of a failed request', type=int, default=3)
+    parser.add_argument('--cache', help='Folder caching pages between runs (revalidated with ETag/Last-Modified)', type=str)
+    args = parser.parse_args()
 
-for country in countries_data:
-    name = country.find('h3', class_='country-name').get_text(strip=True)   # scrape country name
-    capital = country.find('span', class_='country-capital').get_text(strip=True)   # scrape country capital
-    population = country.find('span', class_='country-population').get_text(strip=True)   # scrape country population
-    area = country.find('span', class_='country-area').get_text(strip=True)   # scrape country area
+    if args.cache:
+        Path(args.cache).mkdir(parents=True, exist_ok=True)
 
-    countries[name] = {   # write data to the dictionary
-        'Capital': capital,
-        'Population': population,
-        'Area (km^2)': area
-    }
+    # Step 1: Fetch all pages concurrently (at most --workers requests in flight)
+    pages = [(url, {args.page_param: page} if args.pages > 1 else None) for url in args.urls for page in range(1, args.pages + 1)]
+    session = make_session(args.workers, args.retries)
+    with ThreadPoolExecutor(args.workers) as pool:
+        htmls = pool.map(lambda page: fetch(session, *page, timeout=args.timeout, cache=args.cache), pages)
 
+        # Step 2: Parse the pages in order as they arrive and stream the records to the output file
+        with open_sink(args.filename, args.format, Country, key='name', names=JSON_KEYS) as sink:
+            for html in htmls:
+                for country in parse_countries(html):
+                    sink.write(country)
 
-with open(f'{args.filename}.json', 'w') as f:   # write the dictionary in the .json format
-    json.dump(countries, f, indent=4)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import project5
+
+FIXTURE = Path(__file__).parent / 'fixtures' / 'simple.html'   # local copy of scrapethissite.com/pages/simple/
+COUNTRIES = Path(__file__).resolve().parents[1] / 'countries.json'   # the same page as scraped by the original script
+LAST_MODIFIED = 'Sat, 17 Oct 2026 12:00:00 GMT'
+
+
+# Stand-in for the site -- serves the fixture for every page number, records the requests and counts the ones in flight
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            body = server.page
+            etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+            if ('etag' in server.validators and self.headers.get('If-None-Match') == etag or
+                    'last_modified' in server.validators and self.headers.get('If-Modified-Since') == LAST_MODIFIED):
+                server.statuses.append(304)
+                self.send_response(304)
+                self.end_headers()
+                return
+            server.statuses.append(200)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            if 'etag' in server.validators:
+                self.send_header('ETag', etag)
+            if 'last_modified' in server.validators:
+                self.send_header('Last-Modified', LAST_MODIFIED)
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.page = FIXTURE.read_bytes()
+    server.validators = ('etag', 'last_modified')
+    server.delay = 0
+    server.lock = threading.Lock()
+    server.requests = []
+    server.statuses = []
+    server.in_flight = server.max_in_flight = 0
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/pages/simple/'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run_main(monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ['project5.py', *argv])
+    project5.main()
+
+
+def test_parse_countries():
+    countries = list(project5.parse_countries(FIXTURE.read_bytes()))
+    expected = json.loads(COUNTRIES.read_text(encoding='utf-8'))
+    assert [c.name for c in countries] == list(expected)
+    for c in countries:
+        assert c.capital == expected[c.name]['Capital']
+        assert c.population == int(expected[c.name]['Population'])
+        assert c.area == float(expected[c.name]['Area (km^2)'])
+
+
+def test_pages(site, monkeypatch, tmp_path):
+    run_main(monkeypatch, '-u', site.url, '-p', '3', '-o', 'ndjson', '-f', str(tmp_path / 'countries'))
+    pages = sorted(parse_qs(urlsplit(path).query)['page_num'][0] for path, _ in site.requests)
+    assert pages == ['1', '2', '3']
+    lines = (tmp_path / 'countries.ndjson').read_text(encoding='utf-8').splitlines()
+    assert len(lines) == 3 * 250   # every page parsed, in page order
+    assert json.loads(lines[0]) == {'name': 'Andorra', 'capital': 'Andorra la Vella', 'population': 84000, 'area': 468.0}
+
+
+def test_json_matches_original_output(site, monkeypatch, tmp_path):
+    run_main(monkeypatch, '-u', site.url, '-f', str(tmp_path / 'countries'))
+    countries = json.loads((tmp_path / 'countries.json').read_text(encoding='utf-8'))
+    expected = json.loads(COUNTRIES.read_text(encoding='utf-8'))
+    assert list(countries) == list(expected)
+    assert all(countries[name].keys() == expected[name].keys() for name in expected)
+
+
+def test_concurrency_limit(site, monkeypatch, tmp_path):
+    site.delay = 0.1
+    run_main(monkeypatch, '-u', site.url, '-p', '8', '-w', '2', '-o', 'ndjson', '-f', str(tmp_path / 'countries'))
+    assert len(site.requests) == 8
+    assert site.max_in_flight == 2
+
+
+@pytest.mark.parametrize('validators', [('etag',), ('last_modified',), ('etag', 'last_modified')])
+def test_cache_revalidation(site, tmp_path, validators):
+    site.validators = validators
+    session = project5.make_session(1, 0)
+    first = project5.fetch(session, site.url, cache=tmp_path)
+    second = project5.fetch(session, site.url, cache=tmp_path)
+    assert first == second == site.page
+    assert site.statuses == [200, 304]
+    headers = site.requests[1][1]
+    assert ('If-None-Match' in headers) == ('etag' in validators)
+    assert ('If-Modified-Since' in headers) == ('last_modified' in validators)
+
+
+def test_cache_without_validators(site, tmp_path):
+    site.validators = ()
+    session = project5.make_session(1, 0)
+    assert project5.fetch(session, site.url, cache=tmp_path) == site.page
+    assert not list(tmp_path.iterdir())   # nothing to revalidate with, nothing stored
+
+
+def test_cache_missing_page(site, tmp_path):
+    session = project5.make_session(1, 0)
+    project5.fetch(session, site.url, cache=tmp_path)
+    for html in tmp_path.glob('*.html'):
+        html.unlink()   # metadata left behind, e.g. by an interrupted run
+    assert project5.fetch(session, site.url, cache=tmp_path) == site.page
+    headers = site.requests[1][1]
+    assert 'If-None-Match' not in headers and 'If-Modified-Since' not in headers
+    assert site.statuses == [200, 200]
+    assert len(list(tmp_path.glob('*.html'))) == 1
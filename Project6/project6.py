@@ -1,64 +1,104 @@
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.firefox.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.keys import Keys
-import time
 import argparse
-import json
+import queue
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
 
-parser = argparse.ArgumentParser(description='This is a script for dynamic web-scraping')
-parser.add_argument('-f', '--filename', help='JSON filename to store scraped data')
-args = parser.parse_args()
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))   # make the shared 'common' package importable
+from common.records import FORMATS, open_sink, parse_int, parse_float
 
-url = 'https://webscraper.io/test-sites/e-commerce/scroll'   # LEGAL, made for scraping
+CARDS = 'div.thumbnail'   # product cards
 
-options = Options()
-service = Service('geckodriver.exe')   # Firefox driver
-driver = webdriver.Firefox(service=service, options=options)
-driver.get(url)
+# All loaded cards in one WebDriver round-trip instead of four find_element calls per card
+EXTRACT = '''
+const text = (card, selector) => { const element = card.querySelector(selector); return element ? element.innerText.trim() : ''; };
+return Array.from(document.querySelectorAll(arguments[0]), card => ({
+    title: text(card, 'a.title'),
+    description: text(card, 'p.description'),
+    price: text(card, 'h4.price'),
+    reviews: text(card, 'div.ratings p.pull-right')
+}));
+'''
 
-time.sleep(3)
+# One scraped product, numbers parsed once at scrape time
+@dataclass
+class Product:
+    title: str
+    description: str
+    price: float   # $
+    reviews: int
 
-computers_button = WebDriverWait(driver, 10).until(
-    EC.element_to_be_clickable((By.CSS_SELECTOR, "a[href='/test-sites/e-commerce/scroll/computers']"))
-)
-computers_button.click()   # click 'Computers' button
+def make_driver(driver_path, headless=True):
+    options = Options()
+    if headless:
+        options.add_argument('-headless')   # no window, no rendering to screen
+    service = Service(driver_path)   # Firefox driver
+    return webdriver.Firefox(service=service, options=options)
 
-time.sleep(3)
+def count_cards(driver):
+    return driver.execute_script('return document.querySelectorAll(arguments[0]).length', CARDS)
 
-laptops_button = WebDriverWait(driver, 10).until(
-    EC.element_to_be_clickable((By.CSS_SELECTOR, "a[href='/test-sites/e-commerce/scroll/computers/laptops']"))
-)
-laptops_button.click()   # click 'Laptop' button inside 'Computers'
+# Scroll to the bottom until no new cards appear within `timeout` seconds
+def scroll_all(driver, timeout):
+    count = count_cards(driver)
+    while True:
+        driver.execute_script('window.scrollTo(0, document.body.scrollHeight)')   # scroll and load more content
+        try:
+            WebDriverWait(driver, timeout).until(lambda d: count_cards(d) > count)
+        except TimeoutException:   # nothing more to load
+            return
+        count = count_cards(driver)
 
-time.sleep(3)
+# Load a category page, scroll through all of it and scrape every product card
+def scrape(driver, url, timeout):
+    driver.get(url)
+    WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, CARDS)))   # first cards rendered
+    scroll_all(driver, timeout)
+    return [Product(card['title'], card['description'], parse_float(card['price']), parse_int(card['reviews']))
+            for card in driver.execute_script(EXTRACT, CARDS)]
 
-for _ in range(3):   # scroll and load more content 3 times
-    driver.find_element(By.TAG_NAME, 'body').send_keys(Keys.END)
-    time.sleep(3)
+def main():
+    parser = argparse.ArgumentParser(description='This is a script for dynamic web-scraping')
+    parser.add_argument('-f', '--filename', help='Filename (without extension) to store scraped data')
+    parser.add_argument('-o', '--format', help='Output format', choices=FORMATS, default='json')
+    parser.add_argument('-u', '--urls', help='Category pages to scrape (also file:// or local copies)', nargs='+',
+                        default=['https://webscraper.io/test-sites/e-commerce/scroll/computers/laptops'])   # LEGAL, made for scraping
+    parser.add_argument('-d', '--driver', help='Path to the Firefox driver', type=str, default='geckodriver.exe')
+    parser.add_argument('-w', '--workers', help='Number of headless browsers shared by the category pages', type=int, default=1)
+    parser.add_argument('-t', '--timeout', help='Time to wait for new cards after a scroll (s)', type=float, default=3)
+    parser.add_argument('--show', help='Show the browser windows instead of running headless', action='store_true')
+    args = parser.parse_args()
 
+    # Step 1: Start a pool of browsers, each one is reused for several category pages
+    workers = max(1, min(args.workers, len(args.urls)))
+    drivers = queue.Queue()
+    try:
+        for _ in range(workers):
+            drivers.put(make_driver(args.driver, headless=not args.show))
 
-products = []   # create an empty array to store products' data
+        def scrape_with_pool(url):
+            driver = drivers.get()
+            try:
+                return scrape(driver, url, args.timeout)
+            finally:
+                drivers.put(driver)
 
-product_cards = driver.find_elements(By.CSS_SELECTOR, 'div.thumbnail')   # locate all product cards currently loaded
+        # Step 2: Scrape the pages concurrently and stream the records in page order
+        with ThreadPoolExecutor(workers) as pool, open_sink(args.filename, args.format, Product) as sink:
+            for products in pool.map(scrape_with_pool, args.urls):
+                for product in products:
+                    sink.write(product)
+    finally:
+        while not drivers.empty():
+            drivers.get().quit()
 
-for card in product_cards:
-    title = card.find_element(By.CSS_SELECTOR, 'a.title').text   # scrape product title
-    description = card.find_element(By.CSS_SELECTOR, 'p.description').text   # scrape product description
-    price = card.find_element(By.CSS_SELECTOR, 'h4.price').text   # scrape product price
-    reviews = card.find_element(By.CSS_SELECTOR, 'div.ratings p.pull-right').text   # scrape number of product reviews
-    
-    products.append({   # write data to the dictionary
-        'title': title,
-        'description': description,
-        'price': price,
-        'reviews': reviews
-    })
-
-with open(f'{args.filename}.json', 'w') as f:   # write the dictionary in the .json format
-    json.dump(products, f, indent=4)
-
-driver.quit()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+import pytest
+
+pytest.importorskip('selenium')
+from selenium.common.exceptions import WebDriverException
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import project6
+from common.records import parse_float, parse_int
+
+FIXTURE = Path(__file__).parent / 'fixtures' / 'laptops.html'   # local copy of the scroll page, 3 more cards per scroll
+PRODUCTS = Path(__file__).resolve().parents[1] / 'products.json'   # the same products as scraped by the original script
+DRIVER = os.environ.get('GECKODRIVER') or shutil.which('geckodriver') or shutil.which('geckodriver.exe')
+
+
+@pytest.fixture(scope='module')
+def driver():
+    if not DRIVER:
+        pytest.skip('geckodriver not found (put it on PATH or set GECKODRIVER)')
+    try:
+        driver = project6.make_driver(DRIVER)
+    except WebDriverException as e:
+        pytest.skip(f'cannot start headless Firefox: {e.msg}')
+    yield driver
+    driver.quit()
+
+
+def expected():
+    return [project6.Product(p['title'], p['description'], parse_float(p['price']), parse_int(p['reviews']))
+            for p in json.loads(PRODUCTS.read_text(encoding='utf-8'))]
+
+
+def test_scroll_all(driver):
+    driver.get(FIXTURE.as_uri())
+    assert project6.count_cards(driver) == 3
+    project6.scroll_all(driver, 1)
+    assert project6.count_cards(driver) == 12   # every batch loaded, then stopped after one idle wait
+
+
+def test_scrape(driver):
+    assert project6.scrape(driver, FIXTURE.as_uri(), 1) == expected()
+
+
+def test_driver_pool(driver, monkeypatch, tmp_path):
+    urls = [FIXTURE.as_uri()] * 3
+    monkeypatch.setattr(sys, 'argv', ['project6.py', '-u', *urls, '-d', DRIVER, '-w', '2', '-t', '1',
+                                      '-o', 'ndjson', '-f', str(tmp_path / 'products')])
+    project6.main()
+    lines = (tmp_path / 'products.ndjson').read_text(encoding='utf-8').splitlines()
+    assert [project6.Product(**json.loads(line)) for line in lines] == expected() * 3   # pages kept in order
@@ -1,6 +1,11 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numba
 import numpy as np
 from scipy.integrate import odeint
-import matplotlib.pyplot as plt
+
+METHODS = {'ode': -1, 'gillespie': 0, 'tau-leaping': 1}   # solver codes, the stochastic ones are understood by the kernels
+GILLESPIE, TAU_LEAPING = 0, 1
 
 # beta -- transmission rate, probability of infection per contact × number of contacts per person per unit time
 # gamma -- recovery rate, fraction of infectious individuals recovering per unit time
@@ -13,32 +18,214 @@ def sir_model(y, t, beta, gamma):
     dRdt = gamma * I
     return [dSdt, dIdt, dRdt]
 
-# Time grid
-t = np.linspace(0, 50, 500)
-
-# Initial conditions
-S0 = 100
-I0 = 5
-R0 = 0
-y0 = [S0, I0, R0]
-
-# Parameters
-beta = 0.01
-gamma = 0.5
-
-# Solve the system
-solution = odeint(sir_model, y0, t, args=(beta, gamma))
-S, I, R = solution.T
-
-# Plot
-plt.plot(t, S, label='Susceptible')
-plt.plot(t, I, label='Infected')
-plt.plot(t, R, label='Recovered')
-plt.title(r'$\beta = 0.01$, $\gamma = 0.5$ -- supercriticality')
-plt.xlabel('Time')
-plt.ylabel('Population')
-plt.legend()
-plt.grid(ls='--')
-plt.tight_layout()
-#plt.savefig('SIR_supercriticality.pdf')
-plt.show()
\ No newline at end of file
+# SIR equations of a whole ensemble at once -- y interleaves (S, I, R) of every member, beta and gamma are arrays
+def sir_batch(y, t, beta, gamma):
+    S, I, R = y.reshape(-1, 3).T
+    infection = beta * S * I
+    recovery = gamma * I
+    return np.column_stack((-infection, infection - recovery, recovery)).ravel()
+
+# Integrate one chunk of the ensemble as a single ODE system (members only couple to themselves,
+# so the Jacobian is banded and LSODA never builds a dense one)
+def solve_chunk(beta, gamma, y0, t):
+    solution = odeint(sir_batch, y0.ravel(), t, args=(beta, gamma), ml=2, mu=2)
+    return solution.reshape(len(t), -1, 3).transpose(1, 0, 2)
+
+# Solve the SIR model for every (beta, gamma, y0) -- the arguments are broadcast against each other,
+# y0 has shape (3,) or (n_params, 3); returns an array of shape (n_params, n_t, 3) with S, I, R in the last axis
+def solve_ensemble(beta, gamma, y0, t, workers=1, chunk=1024):
+    beta, gamma = np.atleast_1d(np.asarray(beta, dtype=float)), np.atleast_1d(np.asarray(gamma, dtype=float))
+    y0 = np.asarray(y0, dtype=float)
+    n, = np.broadcast_shapes(beta.shape, gamma.shape, y0.shape[:-1])
+    beta, gamma, y0 = np.broadcast_to(beta, n), np.broadcast_to(gamma, n), np.broadcast_to(y0, (n, 3))
+
+    chunks = [slice(k, min(k + chunk, n)) for k in range(0, n, chunk)]
+    if workers == 1 or len(chunks) == 1:
+        parts = [solve_chunk(beta[s], gamma[s], y0[s], t) for s in chunks]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            parts = list(pool.map(solve_chunk, [beta[s] for s in chunks], [gamma[s] for s in chunks], [y0[s] for s in chunks], [t] * len(chunks)))
+    return np.concatenate(parts)
+
+# Summary metrics of an ensemble solution: peak of I, time of the peak and final size (recovered at the end of the time grid)
+def summarise(t, solution):
+    peak = np.argmax(solution[:, :, 1], axis=1)
+    return {
+        'peak_I': solution[np.arange(len(solution)), peak, 1],
+        'peak_time': t[peak],
+        'final_size': solution[:, -1, 2],
+    }
+
+# Exact stochastic SIR (Gillespie SSA) -- out[k] is the (S, I, R) state at time t[k], only the grid is stored, not the events
+@numba.njit(cache=True)
+def gillespie(S, I, R, beta, gamma, t, out):
+    time = 0.0
+    k = 0
+    while k < t.size:
+        infection = beta * S * I
+        rate = infection + gamma * I
+        time_next = time + np.random.exponential(1 / rate) if rate > 0 else np.inf   # no infected left -- the state is final
+        while k < t.size and t[k] < time_next:   # record the current state on the grid points before the next event
+            out[k, 0], out[k, 1], out[k, 2] = S, I, R
+            k += 1
+        if rate == 0:
+            break
+        if np.random.random() * rate < infection:   # infection
+            S -= 1
+            I += 1
+        else:   # recovery
+            I -= 1
+            R += 1
+        time = time_next
+
+# Approximate stochastic SIR (tau-leaping) -- Poisson numbers of infections and recoveries in each step of length tau,
+# capped so that no compartment goes negative
+@numba.njit(cache=True)
+def tau_leaping(S, I, R, beta, gamma, t, tau, out):
+    step = 0
+    k = 0
+    while k < t.size:
+        while k < t.size and t[k] < (step + 1) * tau:   # grid points inside the step get the state at its start
+            out[k, 0], out[k, 1], out[k, 2] = S, I, R
+            k += 1
+        if I == 0:   # the state is final
+            while k < t.size:
+                out[k, 0], out[k, 1], out[k, 2] = S, I, R
+                k += 1
+            break
+        infections = min(np.random.poisson(beta * S * I * tau), S)
+        recoveries = min(np.random.poisson(gamma * I * tau), I)
+        S -= infections
+        I += infections - recoveries
+        R += recoveries
+        step += 1
+
+# Independent realizations in parallel -- each one is seeded from its own seed, so the results do not depend on the threads
+@numba.njit(cache=True, parallel=True)
+def realizations(S0, I0, R0, beta, gamma, t, method, tau, seeds):
+    out = np.empty((seeds.size, t.size, 3), dtype=np.int32)
+    for r in numba.prange(seeds.size):
+        np.random.seed(seeds[r])
+        if method == GILLESPIE:
+            gillespie(S0, I0, R0, beta, gamma, t, out[r])
+        else:
+            tau_leaping(S0, I0, R0, beta, gamma, t, tau, out[r])
+    return out
+
+# Run n stochastic realizations of one parameter set (seed -- int or SeedSequence); returns an array of shape (n, n_t, 3) (int32 counts)
+def solve_stochastic(beta, gamma, y0, t, n, method=GILLESPIE, tau=0.01, seed=None):
+    sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    seeds = sequence.generate_state(n)   # one independent stream per realization
+    S0, I0, R0 = (int(round(y)) for y in y0)
+    return realizations(S0, I0, R0, float(beta), float(gamma), np.asarray(t, dtype=float), method, float(tau), seeds)
+
+# Distribution of the outcomes of stochastic realizations: extinction by the end of the grid, minor outbreaks
+# (at most `minor` of the susceptibles ever infected) and quantiles of the final size and of the peak of I
+def stochastic_summary(t, solution, minor=0.1, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    metrics = summarise(t, solution)
+    S0 = solution[:, 0, 0]
+    return {
+        'extinction_probability': np.mean(solution[:, -1, 1] == 0),
+        'minor_outbreak_probability': np.mean(S0 - solution[:, -1, 0] <= minor * S0),
+        'quantiles': np.array(quantiles),
+        'final_size_mean': np.mean(metrics['final_size']),
+        'final_size_quantiles': np.quantile(metrics['final_size'], quantiles),
+        'peak_I_mean': np.mean(metrics['peak_I']),
+        'peak_I_quantiles': np.quantile(metrics['peak_I'], quantiles),
+        'peak_time_median': np.median(metrics['peak_time']),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='This is a script for the SIR model')
+    parser.add_argument('-b', '--beta', help='Transmission rates', type=float, nargs='+', default=[0.01])
+    parser.add_argument('-g', '--gamma', help='Recovery rates', type=float, nargs='+', default=[0.5])
+    parser.add_argument('--grid', help='Solve every (beta, gamma) combination instead of pairing the lists', action='store_true')
+    parser.add_argument('--S0', help='Initial number of susceptible individuals', type=float, default=100)
+    parser.add_argument('--I0', help='Initial number of infected individuals', type=float, default=5)
+    parser.add_argument('--R0', help='Initial number of recovered individuals', type=float, default=0)
+    parser.add_argument('-T', '--time', help='Length of the simulation', type=float, default=50)
+    parser.add_argument('-n', '--points', help='Number of points of the time grid', type=int, default=500)
+    parser.add_argument('-m', '--method', help='Deterministic ODE or stochastic realizations (exact SSA or tau-leaping)', choices=list(METHODS), default='ode')
+    parser.add_argument('-N', '--realizations', help='Number of stochastic realizations per parameter set', type=int, default=1000)
+    parser.add_argument('--tau', help='Step of tau-leaping', type=float, default=0.01)
+    parser.add_argument('--minor', help='Largest fraction of susceptibles infected in a minor outbreak', type=float, default=0.1)
+    parser.add_argument('--seed', help='RNG seed of the stochastic realizations', type=int)
+    parser.add_argument('-w', '--workers', help='Number of worker processes for large ODE ensembles (threads for the stochastic methods, default: all)', type=int, default=None)
+    parser.add_argument('--chunk', help='Number of parameter sets integrated together', type=int, default=1024)
+    parser.add_argument('-o', '--output', help='Save t, parameters, solutions and summary metrics to {output}.npz', type=str)
+    parser.add_argument('-p', '--plot', help='Save the plot to this file instead of showing it', type=str)
+    parser.add_argument('--no-plot', help='Only solve (and save/print the summary)', action='store_true')
+    args = parser.parse_args()
+
+    # Step 1: Parameters, initial conditions and time grid
+    if args.grid:
+        beta, gamma = (a.ravel() for a in np.meshgrid(args.beta, args.gamma, indexing='ij'))
+    else:
+        beta, gamma = np.broadcast_arrays(np.array(args.beta), np.array(args.gamma))
+    y0 = [args.S0, args.I0, args.R0]
+    t = np.linspace(0, args.time, args.points)
+
+    # Step 2: Solve the whole ensemble
+    if args.method == 'ode':
+        solution = solve_ensemble(beta, gamma, y0, t, args.workers or 1, args.chunk)
+        summary = summarise(t, solution)
+
+        if args.output:
+            np.savez(f'{args.output}.npz', t=t, beta=beta, gamma=gamma, y0=y0, solution=solution, **summary)
+        for k in range(len(beta)):
+            print(f'beta = {beta[k]:g}, gamma = {gamma[k]:g}: peak I = {summary["peak_I"][k]:.3f} at t = {summary["peak_time"][k]:.3f}, final size = {summary["final_size"][k]:.3f}')
+
+    # Step 2': Stochastic realizations of every parameter set -- mean trajectories and outcome distributions
+    else:
+        if args.workers:
+            numba.set_num_threads(min(args.workers, numba.config.NUMBA_NUM_THREADS))
+        seeds = np.random.SeedSequence(args.seed).spawn(len(beta))   # independent streams per parameter set
+        solution = np.empty((len(beta), len(t), 3))   # mean trajectories
+        bands = np.empty((len(beta), 2, len(t), 3))   # 5% and 95% quantiles of the trajectories
+        summaries = []
+        for k in range(len(beta)):
+            runs = solve_stochastic(beta[k], gamma[k], y0, t, args.realizations, METHODS[args.method], args.tau, seeds[k])
+            solution[k] = runs.mean(axis=0)
+            bands[k] = np.quantile(runs, [0.05, 0.95], axis=0)
+            summaries.append(stochastic_summary(t, runs, args.minor))
+            summary = summaries[-1]
+            q = dict(zip(summary['quantiles'], summary['final_size_quantiles']))
+            print(f'beta = {beta[k]:g}, gamma = {gamma[k]:g}: P(extinct by T) = {summary["extinction_probability"]:.3f}, '
+                  f'P(minor outbreak) = {summary["minor_outbreak_probability"]:.3f}, final size median = {q[0.5]:g} '
+                  f'(90% in [{q[0.05]:g}, {q[0.95]:g}]), peak I mean = {summary["peak_I_mean"]:.3f}')
+
+        if args.output:
+            np.savez(f'{args.output}.npz', t=t, beta=beta, gamma=gamma, y0=y0, solution=solution, bands=bands,
+                     **{key: np.array([summary[key] for summary in summaries]) for key in summaries[0]})
+
+    # Step 3: Plot
+    if args.no_plot:
+        return
+    import matplotlib.pyplot as plt   # only needed for the plot
+
+    if len(beta) == 1:
+        S, I, R = solution[0].T
+        regime = 'supercriticality' if beta[0] * args.S0 / gamma[0] > 1 else 'subcriticality'   # basic reproduction number above or below 1
+        plt.plot(t, S, label='Susceptible')
+        plt.plot(t, I, label='Infected')
+        plt.plot(t, R, label='Recovered')
+        if args.method != 'ode':   # mean of the realizations with their 5-95% band
+            for c in range(3):
+                plt.fill_between(t, bands[0, 0, :, c], bands[0, 1, :, c], alpha=0.2)
+        plt.title(rf'$\beta = {beta[0]:g}$, $\gamma = {gamma[0]:g}$ -- {regime}')
+    else:
+        for k in range(len(beta)):
+            plt.plot(t, solution[k, :, 1], label=rf'$\beta = {beta[k]:g}$, $\gamma = {gamma[k]:g}$')
+        plt.title('Infected')
+    plt.xlabel('Time')
+    plt.ylabel('Population')
+    plt.legend()
+    plt.grid(ls='--')
+    plt.tight_layout()
+    if args.plot:
+        plt.savefig(args.plot)   # e.g. 'SIR_supercriticality.pdf'
+    else:
+        plt.show()
+
+if __name__ == '__main__':
+    main()
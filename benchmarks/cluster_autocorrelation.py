@@ -0,0 +1,73 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'Project4'))
+import project4   # numba kernels
+from common.autocorrelation import integrated_autocorrelation_time
+
+BETA_C = np.log(1 + np.sqrt(2)) / 2   # critical temperature of the 2D Ising model (J = 1, B = 0)
+
+
+# Run one chain and measure its cost per macrostep and the integrated autocorrelation times of E and |M|
+def measure(n, algorithm, J, B, b, thermalisation, steps, clusters, seed):
+    project4.seed(seed)
+    grid = project4.spins(n, 0.5)
+    code = project4.ALGORITHMS[algorithm]
+    bonds, M = project4.calc_bonds(n, grid), np.sum(grid)
+    bonds, M = project4.run(grid, thermalisation, J, B, b, bonds, M, np.empty(thermalisation), np.empty(thermalisation), code, clusters)   # also compiles
+
+    energy = np.empty(steps)
+    magnetisation = np.empty(steps)
+    start = time.perf_counter()
+    project4.run(grid, steps, J, B, b, bonds, M, energy, magnetisation, code, clusters)
+    elapsed = time.perf_counter() - start
+
+    tau_E = integrated_autocorrelation_time(energy)
+    tau_M = integrated_autocorrelation_time(np.abs(magnetisation))
+    tau = np.nanmax([tau_E, tau_M, 0.5])
+    return {
+        'size': n,
+        'algorithm': algorithm,
+        'beta': b,
+        'seconds_per_macrostep': elapsed / steps,
+        'tau_E': tau_E,   # in macrosteps
+        'tau_M': tau_M,
+        'independent_samples_per_second': steps / (2 * tau) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Integrated autocorrelation times of Metropolis vs cluster updates (Project4 kernels)')
+    parser.add_argument('--sizes', help='Grid sizes n', type=int, nargs='+', default=[16, 32, 64])
+    parser.add_argument('--algorithms', help='Dynamics to compare', nargs='+', choices=list(project4.ALGORITHMS), default=list(project4.ALGORITHMS))
+    parser.add_argument('-J', '--J_value', help='Exchange coupling', type=float, default=1.0)
+    parser.add_argument('-B', '--B_value', help='External magnetic field', type=float, default=0.0)
+    parser.add_argument('-b', '--beta_value', help='Temperature -- beta = 1 / (k_B T), critical by default', type=float, default=BETA_C)
+    parser.add_argument('-t', '--thermalisation', help='Number of discarded macrosteps', type=int, default=1000)
+    parser.add_argument('-S', '--steps', help='Number of measured macrosteps', type=int, default=10000)
+    parser.add_argument('--clusters', help='Number of Wolff cluster updates per macrostep', type=int, default=1)
+    parser.add_argument('--seed', help='RNG seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='JSON filename to store the results', type=str)
+    args = parser.parse_args()
+
+    results = []
+    print(f'{"n":>6} {"algorithm":>14} {"s/macrostep":>12} {"tau_E":>9} {"tau_|M|":>9} {"indep. samples/s":>17}')
+    for n in args.sizes:
+        for algorithm in args.algorithms:
+            r = measure(n, algorithm, args.J_value, args.B_value, args.beta_value, args.thermalisation, args.steps, args.clusters, args.seed)
+            results.append(r)
+            print(f'{n:>6} {algorithm:>14} {r["seconds_per_macrostep"]:>12.3e} {r["tau_E"]:>9.2f} {r["tau_M"]:>9.2f} {r["independent_samples_per_second"]:>17.1f}')
+
+    if args.output:
+        with open(f'{args.output}.json', 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import argparse
+import gc
+import json
+import multiprocessing
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'Project2'))
+sys.path.insert(0, str(ROOT / 'Project4'))
+import project2   # NumPy engines
+import project4   # numba kernels
+from common.autocorrelation import integrated_autocorrelation_time
+from common.instrumentation import measure, timing
+
+BETA_C = np.log(1 + np.sqrt(2)) / 2   # critical temperature of the 2D Ising model (J = 1, B = 0)
+ENGINES = ('checkerboard', 'multispin', 'sequential', 'numba')   # Project2 sweeps / bit-packed sweeps / random-site flips, Project4 kernel
+
+
+# Resident memory from /proc/self/status (Linux), in bytes
+def read_status(key):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(key + ':'):
+                return int(line.split()[1]) * 1024
+
+
+# Reset the resident high-water mark to the current resident memory and return it (None where /proc is not available)
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return read_status('VmRSS')
+    except OSError:
+        return None
+
+
+# Build one engine as (macrostep function, function returning the running totals (E, M))
+def make_engine(engine, n, rho, J, B, b, seed):
+    if engine == 'numba':
+        project4.seed(seed)
+        grid = project4.spins(n, rho)
+        state = [project4.calc_bonds(n, grid), int(np.sum(grid))]
+        energy, magnetisation = np.empty(1), np.empty(1)
+
+        def step():
+            state[0], state[1] = project4.run(grid, 1, J, B, b, state[0], state[1], energy, magnetisation)
+        return step, lambda: (-J * state[0] - B * state[1], state[1])
+
+    model = (project2.PackedIsing if engine == 'multispin' else project2.Ising)(n, rho, J, B, b, 0, seed)
+    if engine == 'sequential':
+        def step():
+            for _ in range(n * n):
+                model.mc_step()
+    else:
+        step = model.sweep
+    return step, lambda: (model.E, model.M)
+
+
+# Mean of a series and its error from the integrated autocorrelation time
+def estimate(x):
+    tau = integrated_autocorrelation_time(x)
+    error = np.std(x) * np.sqrt(2 * tau / len(x)) if np.isfinite(tau) else 0.0
+    return float(np.mean(x)), float(error), float(tau)
+
+
+# Peak memory of a fresh engine over a few macrosteps -- the growth of the resident high-water mark counts every
+# allocation, numba's included; without /proc fall back to tracemalloc, which sees only Python and NumPy allocations
+def engine_memory(engine, n, rho, J, B, b, memory_steps, seed):
+    warmup, _ = make_engine(engine, 64, rho, J, B, b, seed)   # load the compiled kernels before the baseline
+    warmup()
+    del warmup
+    gc.collect()
+    baseline = reset_peak_rss()
+    if baseline is None:
+        tracemalloc.start()
+    step, _ = make_engine(engine, n, rho, J, B, b, seed)
+    for _ in range(memory_steps):
+        step()
+    if baseline is None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak, 'tracemalloc'
+    return read_status('VmHWM') - baseline, 'rss'
+
+
+# Run engine_memory in a new process, so memory freed by earlier benchmarks is not reused and hidden from the RSS
+def peak_memory(*args):
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(engine_memory, *args).result()
+
+
+# Benchmark one engine at one grid size and temperature
+def benchmark(engine, n, rho, J, B, b, thermalisation, steps, seed):
+    N = n * n
+
+    # Step 1: The first macrostep on its own -- includes JIT compilation (or loading it from the cache) for numba
+    step, totals = make_engine(engine, n, rho, J, B, b, seed)
+    start = time.perf_counter()
+    step()
+    first = time.perf_counter() - start
+
+    # Step 2: Thermalisation, then timed macrosteps with the observables recorded after each one
+    for _ in range(thermalisation):
+        step()
+    energy = np.empty(steps)
+    magnetisation = np.empty(steps)
+    name = f'{engine}/n={n}/beta={b:g}'
+    timing(name, size=steps).reset()
+    for i in range(steps):
+        with measure(name):
+            step()
+        energy[i], magnetisation[i] = totals()
+    stats = timing(name).summary()
+
+    e, e_err, tau_e = estimate(energy / N)
+    m = magnetisation / N if B != 0 else np.abs(magnetisation) / N   # <|M|> at B = 0, where the sign of M is arbitrary
+    m, m_err, tau_m = estimate(m)
+    return {
+        'engine': engine,
+        'size': n,
+        'beta': b,
+        'rho': rho,
+        'thermalisation': thermalisation,
+        'steps': steps,
+        'flips_per_second': N / stats['mean'],   # spin-flip attempts
+        'seconds_per_macrostep': stats['mean'],
+        'seconds_per_macrostep_p50': stats['p50'],
+        'seconds_per_macrostep_p99': stats['p99'],
+        'first_macrostep_seconds': first,   # JIT warm-up for numba
+        'E': e, 'E_err': e_err, 'tau_E': tau_e,   # per spin
+        'M': m, 'M_err': m_err, 'tau_M': tau_m,   # per spin, |M| at B = 0
+    }
+
+
+# z-scores of <E> and <M> of every engine against the first one at the same size and temperature
+def equivalence(results, threshold):
+    checks = []
+    groups = {}
+    for r in results:
+        groups.setdefault((r['size'], r['beta']), []).append(r)
+    for (n, b), group in groups.items():
+        reference = group[0]
+        for r in group[1:]:
+            check = {'size': n, 'beta': b, 'reference': reference['engine'], 'engine': r['engine']}
+            for key in ('E', 'M'):
+                error = np.hypot(reference[f'{key}_err'], r[f'{key}_err'])
+                difference = abs(r[key] - reference[key])
+                check[f'z_{key}'] = float(difference / error) if error > 0 else (0.0 if difference == 0 else float('inf'))
+            check['consistent'] = bool(max(check['z_E'], check['z_M']) < threshold)
+            checks.append(check)
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Speed, memory and statistical equivalence of the Project2 and Project4 Ising engines')
+    parser.add_argument('--engines', help='Engines to compare', nargs='+', choices=ENGINES, default=list(ENGINES))
+    parser.add_argument('--sizes', help='Grid sizes n', type=int, nargs='+', default=[32, 64, 128, 256, 512, 1024, 2048, 4096])
+    parser.add_argument('--betas', help='Temperatures -- beta = 1 / (k_B T)', type=float, nargs='+', default=[0.3, BETA_C, 0.6])
+    parser.add_argument('-r', '--rho', help='Initial density of +1 spins (default: an ordered start, 1, at and below T_c, where random '
+                        'starts freeze into long-lived domains, and a random start, 0.5, above it)', type=float)
+    parser.add_argument('-J', '--J_value', help='Exchange coupling', type=float, default=1.0)
+    parser.add_argument('-B', '--B_value', help='External magnetic field', type=float, default=0.0)
+    parser.add_argument('-t', '--thermalisation', help='Largest number of discarded macrosteps', type=int, default=500)
+    parser.add_argument('-S', '--steps', help='Largest number of measured macrosteps', type=int, default=2000)
+    parser.add_argument('--min-steps', help='Smallest number of thermalisation and measured macrosteps', type=int, default=20)
+    parser.add_argument('--flips', help='Budget of spin-flip attempts per measurement (fewer macrosteps on large grids, '
+                        'grids needing more than --min-steps macrosteps of it are skipped)', type=float, default=4e8)
+    parser.add_argument('--sequential-flips', help='Budget of the pure-Python sequential engine', type=float, default=2e6)
+    parser.add_argument('--memory-steps', help='Macrosteps of a fresh engine measured for the peak memory', type=int, default=2)
+    parser.add_argument('--threshold', help='Largest z-score of consistent <E> and <M> estimates', type=float, default=3.0)
+    parser.add_argument('--seed', help='RNG seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='JSON filename to store the results', type=str)
+    args = parser.parse_args()
+
+    results = []
+    skipped = []   # engine / size pairs whose --min-steps macrosteps exceed the flip budget
+    memory = {}   # (engine, n) -> (peak bytes, method), the same at every temperature
+    print(f'{"engine":>12} {"n":>5} {"beta":>7} {"steps":>6} {"flips/s":>10} {"first step":>11} {"peak MiB":>9} {"<e>":>20} {"<m>":>20}')
+    for n in args.sizes:
+        for b in args.betas:
+            rho = args.rho if args.rho is not None else (1.0 if b >= BETA_C else 0.5)
+            for engine in args.engines:
+                if engine == 'multispin' and n % 64:
+                    continue   # packs 64 spins per word along a row
+                budget = args.sequential_flips if engine == 'sequential' else args.flips
+                if args.min_steps * n * n > budget:
+                    skipped.append({'engine': engine, 'size': n, 'beta': b, 'budget': budget,
+                                    'reason': f'{args.min_steps} macrosteps need {args.min_steps * n * n:.3g} flips, more than the budget'})
+                    print(f'{engine:>12} {n:>5} {b:>7.4f}  skipped -- {args.min_steps} macrosteps exceed the flip budget of {budget:.3g}')
+                    continue
+                steps = int(max(args.min_steps, min(args.steps, budget // (n * n))))
+                thermalisation = int(max(args.min_steps, min(args.thermalisation, budget // (n * n) // 4)))
+                r = benchmark(engine, n, rho, args.J_value, args.B_value, b, thermalisation, steps, args.seed)
+                if (engine, n) not in memory:
+                    memory[engine, n] = peak_memory(engine, n, rho, args.J_value, args.B_value, b, args.memory_steps, args.seed)
+                r['peak_memory_bytes'], r['peak_memory_method'] = memory[engine, n]
+                results.append(r)
+                print(f'{engine:>12} {n:>5} {b:>7.4f} {steps:>6} {r["flips_per_second"]:>10.3e} {r["first_macrostep_seconds"]:>10.3f}s '
+                      f'{r["peak_memory_bytes"] / 2**20:>9.2f} {r["E"]:>10.5f} ± {r["E_err"]:<7.5f} {r["M"]:>10.5f} ± {r["M_err"]:<7.5f}')
+
+    checks = equivalence(results, args.threshold)
+    if checks:
+        print(f'\n{"engine":>12} {"reference":>12} {"n":>5} {"beta":>7} {"z_E":>7} {"z_M":>7}')
+        for c in checks:
+            print(f'{c["engine"]:>12} {c["reference"]:>12} {c["size"]:>5} {c["beta"]:>7.4f} {c["z_E"]:>7.2f} {c["z_M"]:>7.2f}' + ('' if c['consistent'] else '  INCONSISTENT'))
+
+    if args.output:
+        with open(f'{args.output}.json', 'w') as f:
+            json.dump({'config': vars(args), 'results': results, 'skipped': skipped, 'equivalence': checks}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
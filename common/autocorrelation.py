@@ -0,0 +1,21 @@
+import numpy as np
+
+# Integrated autocorrelation time tau_int = 1/2 + sum_t rho(t) of a time series, in units of its sampling step
+# The sum is cut at the first window M >= c * tau_int(M) (Sokal's automatic windowing)
+def integrated_autocorrelation_time(x, c=5):
+    x = np.asarray(x, dtype=float)
+    x = x - np.mean(x)
+    n = x.size
+    f = np.fft.rfft(x, 2 * n)   # zero padding avoids circular correlations
+    acf = np.fft.irfft(f * np.conj(f))[:n]
+    if acf[0] == 0:
+        return np.nan   # constant series
+
+    tau = 0.5 + np.cumsum(acf[1:] / acf[0])   # tau[M - 1] = 1/2 + sum_{t=1}^{M} rho(t)
+    window = np.arange(1, n) >= c * tau
+    return tau[np.argmax(window)] if window.any() else tau[-1]
+
+
+# Number of statistically independent samples in a correlated time series
+def effective_samples(x, c=5):
+    return len(x) / (2 * integrated_autocorrelation_time(x, c))
@@ -0,0 +1,24 @@
+import json
+import os
+import numpy as np
+
+# Checkpoints are single .npz files (compact binary) -- written to a temporary file and renamed,
+# so a run killed while saving still has its previous checkpoint
+def save_checkpoint(path, **state):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **state)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def generator_state(rng):   # np.random.Generator state as a storable string
+    return np.array(json.dumps(rng.bit_generator.state))
+
+
+def restore_generator(rng, state):
+    rng.bit_generator.state = json.loads(str(state))
@@ -0,0 +1,176 @@
+import contextlib
+import functools
+import json
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+# Low-overhead timing of instrumented functions and code blocks -- every sample updates running (Welford) mean and
+# variance, min, max and a fixed-size ring buffer of the latest samples for percentiles, so memory stays bounded;
+# the first `warmup` calls (e.g. JIT compilation) are counted but kept out of the statistics
+class Timing:
+
+    def __init__(self, name, warmup=0, size=1024, cpu=False, memory=False):
+        self.name = name
+        self.warmup = int(warmup)
+        self.cpu = cpu   # also track process CPU time
+        self.memory = memory   # also track the tracemalloc peak
+        self.buffer = [0] * max(1, int(size))   # latest wall times (ns) -- a plain list is cheaper to write than an array
+        self.reset()
+
+
+    def reset(self):
+        self.skipped = 0   # warm-up calls
+        self.calls = 0
+        self.mean = 0.0   # wall time (ns)
+        self.m2 = 0.0
+        self.min = float('inf')
+        self.max = 0
+        self.total = 0
+        self.cpu_total = 0
+        self.peak = 0   # largest tracemalloc peak (bytes)
+
+
+    def record(self, wall, cpu=0, peak=0):   # times in ns
+        if self.skipped < self.warmup:
+            self.skipped += 1
+            return
+        self.buffer[self.calls % len(self.buffer)] = wall
+        self.calls += 1
+        delta = wall - self.mean
+        self.mean += delta / self.calls
+        self.m2 += delta * (wall - self.mean)
+        if wall < self.min:
+            self.min = wall
+        if wall > self.max:
+            self.max = wall
+        self.total += wall
+        self.cpu_total += cpu
+        if peak > self.peak:
+            self.peak = peak
+
+
+    def summary(self):   # times in s
+        samples = self.buffer[:min(self.calls, len(self.buffer))]
+        p50, p90, p99 = np.percentile(samples, [50, 90, 99]) / 1e9 if self.calls else (np.nan,) * 3
+        summary = {
+            'name': self.name,
+            'calls': self.calls,
+            'warmup': self.skipped,
+            'mean': self.mean / 1e9 if self.calls else np.nan,
+            'std': np.sqrt(self.m2 / (self.calls - 1)) / 1e9 if self.calls > 1 else np.nan,
+            'min': self.min / 1e9 if self.calls else np.nan,
+            'p50': float(p50),
+            'p90': float(p90),
+            'p99': float(p99),
+            'max': self.max / 1e9 if self.calls else np.nan,
+            'total': self.total / 1e9,
+        }
+        if self.cpu:
+            summary['cpu_mean'] = self.cpu_total / self.calls / 1e9 if self.calls else np.nan
+        if self.memory:
+            summary['peak_memory'] = self.peak   # bytes
+        return summary
+
+
+    def get_stats(self):
+        s = self.summary()
+        return (f'Mean: {format_time(s["mean"])}, std: {format_time(s["std"])}, min: {format_time(s["min"])}, '
+                f'max: {format_time(s["max"])}, median: {format_time(s["p50"])}, p99: {format_time(s["p99"])} ({s["calls"]} calls)')
+
+
+REGISTRY = {}   # name -> Timing of everything instrumented in this process
+TRACING = {'depth': 0, 'started': False}   # open memory-tracked blocks, and whether the outermost one started tracemalloc
+TRACING_LOCK = threading.Lock()
+
+
+def timing(name, **options):   # the registered Timing of a name (created on first use)
+    if name not in REGISTRY:
+        REGISTRY[name] = Timing(name, **options)
+    return REGISTRY[name]
+
+
+@contextlib.contextmanager
+def measure(name, **options):   # time a block of code
+    entry = timing(name, **options)
+    if entry.memory:
+        with TRACING_LOCK:
+            if TRACING['depth'] == 0:   # trace only while memory-tracked blocks are open, unless the caller traces anyway
+                TRACING['started'] = not tracemalloc.is_tracing()
+                if TRACING['started']:
+                    tracemalloc.start()
+            TRACING['depth'] += 1
+        tracemalloc.reset_peak()   # the peak is process-wide -- nested memory-tracked blocks share it
+    cpu = time.process_time_ns() if entry.cpu else 0
+    start = time.perf_counter_ns()
+    try:
+        yield entry
+    finally:
+        wall = time.perf_counter_ns() - start
+        cpu = time.process_time_ns() - cpu if entry.cpu else 0
+        peak = tracemalloc.get_traced_memory()[1] if entry.memory else 0
+        entry.record(wall, cpu, peak)
+        if entry.memory:
+            with TRACING_LOCK:
+                TRACING['depth'] -= 1
+                if TRACING['depth'] == 0 and TRACING['started']:
+                    tracemalloc.stop()
+
+
+def instrument(function=None, *, name=None, **options):   # decorator, @instrument or @instrument(name=..., warmup=..., ...)
+    if function is None:
+        return lambda function: instrument(function, name=name, **options)
+    entry = timing(name or function.__qualname__, **options)
+
+    if entry.cpu or entry.memory:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with measure(entry.name):
+                return function(*args, **kwargs)
+    else:   # the common case without the context manager overhead
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                entry.record(time.perf_counter_ns() - start)
+
+    wrapper.timing = entry
+    wrapper.get_stats = entry.get_stats
+    return wrapper
+
+
+def format_time(seconds):
+    if not np.isfinite(seconds):
+        return '-'
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('µs', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.3f} {unit}'
+    return f'{seconds / 1e-9:.0f} ns'
+
+
+def report(format='table'):   # all registered timings that were used, as an aligned text table or JSON
+    summaries = [entry.summary() for entry in REGISTRY.values() if entry.calls or entry.skipped]
+    if format == 'json':
+        return json.dumps([{key: (None if isinstance(value, float) and np.isnan(value) else value) for key, value in s.items()}
+                           for s in summaries], indent=4)
+    columns = ['name', 'calls', 'warmup', 'mean', 'std', 'min', 'p50', 'p90', 'p99', 'max', 'total', 'cpu_mean', 'peak_memory']
+    columns = [c for c in columns if any(c in s for s in summaries)]
+    rows = [[str(s.get(c, '')) if c in ('name', 'calls', 'warmup') else
+             f'{s[c] / 2**20:.2f} MiB' if c == 'peak_memory' and c in s else
+             format_time(s[c]) if c in s else '' for c in columns] for s in summaries]
+    widths = [max([len(c)] + [len(row[k]) for row in rows]) for k, c in enumerate(columns)]
+    lines = ['  '.join(c.ljust(w) for c, w in zip(columns, widths))]
+    lines += ['  '.join(v.ljust(w) for v, w in zip(row, widths)) for row in rows]
+    return '\n'.join(lines)
+
+
+def save_report(path):
+    with open(path, 'w') as f:
+        f.write(report('json'))
+
+
+def reset():
+    REGISTRY.clear()
@@ -0,0 +1,14 @@
+import numpy as np
+
+# Metropolis acceptance probabilities for a single spin flip on a 4-neighbour lattice
+# dE = 2 * s * (J * nn + B) with s in {-1, 1} and nn in {-4, -2, 0, 2, 4} -- only 10 distinct moves,
+# so min(1, exp(-b * dE)) is evaluated once per (J, B, b) and looked up as table[(s + 1) // 2, (nn + 4) // 2]
+def acceptance_table(J, B, b):
+    table = np.empty((2, 5))
+    for k in range(2):
+        s = 2 * k - 1   # spin value
+        for l in range(5):
+            nn = 2 * l - 4   # sum of 4 nearest neighbours
+            dE = 2 * s * (J * nn + B)
+            table[k, l] = 1.0 if dE <= 0 else np.exp(-b * dE)   # downhill moves are always accepted
+    return table
@@ -0,0 +1,150 @@
+import numpy as np
+from common.metropolis import acceptance_table
+
+# Multispin-coded Ising lattice -- one bit per spin (1 = +1, 0 = -1) packed into uint64 words, so 64 spins of a row
+# are updated together with bitwise operations; an n x n grid (n a multiple of 64) is stored as an (n, n // 64) array
+# Bit k of word w in row i holds the spin in column 64 * w + k
+
+EVEN = np.uint64(0x5555555555555555)   # bits of the even columns
+ODD = np.uint64(0xAAAAAAAAAAAAAAAA)   # bits of the odd columns
+ONE = np.uint64(1)
+SHIFT = np.uint64(63)
+
+
+def pack(spins):   # +-1 grid -> packed words
+    n = spins.shape[0]
+    bits = np.packbits((spins > 0).reshape((n, -1, 64)), axis=-1, bitorder='little')   # 8 bytes per 64 spins
+    return bits.view('<u8').reshape((n, -1)).astype(np.uint64)
+
+
+def unpack(words, step=1):   # packed words -> +-1 grid of int8, keeping every step-th row and column
+    rows = np.ascontiguousarray(words[::step]).astype('<u8')
+    bits = np.unpackbits(rows.view(np.uint8), axis=-1, bitorder='little')[:, ::step]
+    return (2 * bits.astype(np.int8) - 1)
+
+
+def popcount(words):   # total number of set bits
+    if hasattr(np, 'bitwise_count'):   # NumPy >= 2.0
+        return int(np.sum(np.bitwise_count(words), dtype=np.int64))
+    x = words - ((words >> ONE) & np.uint64(0x5555555555555555))   # SWAR bit counting
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return int(np.sum((x * np.uint64(0x0101010101010101)) >> np.uint64(56), dtype=np.int64))
+
+
+def random_words(rng, shape):   # uniformly random uint64 words, rng is a np.random.Generator (or np.random)
+    return np.frombuffer(rng.bytes(8 * int(np.prod(shape))), dtype=np.uint64).reshape(shape)
+
+
+# Words whose bits are independently 1 with probability p (truncated to len(random) bits) -- p = 0.b1 b2 ... bK in binary
+# is built from the least significant digit: OR with a random word gives (1 + P) / 2, AND gives P / 2
+def bernoulli_words(p, random):
+    if p >= 1:   # q = 2**precision would have none of the bits 0..precision-1 set
+        return np.full(random.shape[1:], np.uint64(2**64 - 1))
+    if p <= 0:
+        return np.zeros(random.shape[1:], dtype=np.uint64)
+    precision = random.shape[0]
+    q = int(p * 2 ** precision)
+    mask = np.zeros(random.shape[1:], dtype=np.uint64)
+    for k in range(precision):
+        if (q >> k) & 1:
+            mask = random[k] | mask
+        elif mask.any():   # AND with an all-zero mask stays zero
+            mask = random[k] & mask
+    return mask
+
+
+def block_rows(n):   # rows per block, keeps the random words of a block at a few MB
+    return max(1, 65536 // max(1, n // 64))
+
+
+def random_lattice(n, rho, rng, precision=32):   # every spin is +1 with probability rho
+    if n % 64:
+        raise ValueError('Packed grid size must be a multiple of 64')
+    words = np.empty((n, n // 64), dtype=np.uint64)
+    for r0 in range(0, n, block_rows(n)):
+        rows = words[r0:r0 + block_rows(n)]
+        rows[...] = bernoulli_words(rho, random_words(rng, (precision,) + rows.shape))
+    return words
+
+
+def spin_sum(words):   # sum of spins (magnetisation times N)
+    return 2 * popcount(words) - 64 * words.size
+
+
+def bonds(words):   # sum of s_i s_j over all nearest-neighbour bonds = number of bonds - 2 * anti-aligned bonds
+    right = (words >> ONE) | (np.roll(words, -1, axis=1) << SHIFT)   # right neighbours of every spin
+    down = np.roll(words, -1, axis=0)
+    return 2 * 64 * words.size - 2 * (popcount(words ^ right) + popcount(words ^ down))
+
+
+# Bit-sliced count of anti-aligned neighbours (0..4) of 64 spins at once -- returns the bit planes of the count
+def anti_aligned(w, up, down, left, right):
+    a1, a2, a3, a4 = w ^ up, w ^ down, w ^ left, w ^ right
+    s1, c1 = a1 ^ a2, a1 & a2   # half adders
+    s2, c2 = a3 ^ a4, a3 & a4
+    ones, carry = s1 ^ s2, s1 & s2
+    twos = c1 ^ c2 ^ carry   # c1 + c2 + carry <= 2 and carry excludes c1, c2
+    fours = c1 & c2
+    return ones, twos, fours
+
+
+# Metropolis update of one checkerboard sublattice (colour 0 or 1), in blocks of rows
+# Every spin with c anti-aligned neighbours has s * nn = 4 - 2c, so dE = 2 J (4 - 2c) + 2 B s takes 10 values;
+# flips are drawn class by class from Bernoulli words of the acceptance probabilities
+# Returns the changes of the bond sum and of the spin sum
+def sublattice_update(words, colour, table, rng, precision=32):
+    n = words.shape[0]
+    d_bonds = 0
+    d_M = 0
+    for r0 in range(0, n, block_rows(n)):
+        rows = np.arange(r0, min(r0 + block_rows(n), n))
+        w = words[rows]
+        up = words[(rows - 1) % n]   # rows wrap around -- periodic boundary conditions
+        down = words[(rows + 1) % n]
+        left = (w << ONE) | (np.roll(w, 1, axis=1) >> SHIFT)   # carry the bit across word boundaries
+        right = (w >> ONE) | (np.roll(w, -1, axis=1) << SHIFT)
+        ones, twos, fours = anti_aligned(w, up, down, left, right)
+
+        counts = (~ones & ~twos & ~fours, ones & ~twos, ~ones & twos, ones & twos, fours)   # c = 0, ..., 4
+        sublattice = np.where(((colour - rows) % 2 == 0)[:, None], EVEN, ODD)   # sites with (i + j) % 2 == colour
+        random = random_words(rng, (precision,) + w.shape)
+
+        # Step 1: Group the (s, c) classes by acceptance probability
+        classes = []
+        groups = {}
+        for s, spin_bits in ((1, w), (-1, ~w)):
+            for c in range(5):
+                mask = sublattice & spin_bits & counts[c]
+                P = table[1, 4 - c] if s == 1 else table[0, c]   # nn = s (4 - 2c)
+                classes.append((mask, s, c))
+                groups[P] = groups.get(P, 0) | mask
+
+        # Step 2: Accepted flips -- all of a class with P >= 1, a Bernoulli(P) subset otherwise
+        flip = np.zeros_like(w)
+        for P, mask in groups.items():
+            if P >= 1:
+                flip |= mask
+            elif P > 0:
+                flip |= mask & bernoulli_words(P, random)
+
+        # Step 3: Running totals, each flip changes the bond sum by -2 s nn = 4c - 8 and the spin sum by -2s
+        for mask, s, c in classes:
+            accepted = popcount(flip & mask)
+            d_bonds += accepted * (4 * c - 8)
+            d_M -= 2 * s * accepted
+
+        words[rows] = w ^ flip
+    return d_bonds, d_M
+
+
+# One multispin-coded Metropolis sweep -- both sublattices, N spin flip attempts
+def checkerboard_sweep(words, J, B, b, rng, precision=32):
+    table = acceptance_table(J, B, b)
+    d_bonds = 0
+    d_M = 0
+    for colour in (0, 1):
+        db, dm = sublattice_update(words, colour, table, rng, precision)
+        d_bonds += db
+        d_M += dm
+    return d_bonds, d_M
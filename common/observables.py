@@ -0,0 +1,71 @@
+import numpy as np
+
+# Buffered writer of one observable recorded every macrostep -- values are kept in a preallocated NumPy buffer
+# and flushed in chunks instead of reopening the file on every macrostep
+#   '.npy' -- compact binary, float64 values in a memory-mapped array (the step is the index)
+#   anything else -- tab-separated text 'step\tvalue', as before
+class ObservableWriter:
+
+    def __init__(self, path, length, chunk=1024, start=0):   # start > 0 continues an existing file from that step
+        self.path = str(path)
+        self.buffer = np.empty(max(1, int(chunk)))
+        self.filled = 0   # number of buffered values
+        self.step = int(start)   # step of the first buffered value
+
+        if self.path.endswith('.npy'):
+            self.binary = True
+            if self.step:
+                self.file = np.load(self.path, mmap_mode='r+')
+                if self.file.shape[0] != int(length):   # the run got longer or shorter -- rebuild the file with the kept steps
+                    kept = np.array(self.file[:self.step])
+                    del self.file
+                    self.file = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.float64, shape=(int(length),))
+                    self.file[:self.step] = kept
+            else:
+                self.file = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.float64, shape=(int(length),))
+        else:
+            self.binary = False
+            if self.step:
+                with open(self.path, 'rb') as f:   # keep the first start lines, anything written later is redone
+                    for _ in range(self.step):
+                        f.readline()
+                    offset = f.tell()
+                self.file = open(self.path, 'a')
+                self.file.truncate(offset)
+            else:
+                self.file = open(self.path, 'w')
+
+
+    def append(self, value):
+        self.buffer[self.filled] = value
+        self.filled += 1
+        if self.filled == self.buffer.size:
+            self.flush()
+
+
+    def flush(self):
+        values = self.buffer[:self.filled]
+        if self.binary:
+            self.file[self.step:self.step + self.filled] = values
+            self.file.flush()
+        else:
+            self.file.write(''.join(f'{self.step + k}\t{v}\n' for k, v in enumerate(values.tolist())))   # one write per chunk
+            self.file.flush()
+        self.step += self.filled
+        self.filled = 0
+
+
+    def close(self):
+        self.flush()
+        if self.binary:
+            del self.file   # release the memory map
+        else:
+            self.file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,136 @@
+import csv
+import dataclasses
+import json
+import re
+
+# Record sinks for scraped datasets -- records (dataclass instances) are written as they arrive, so memory stays
+# constant however long the scrape is
+#   'json'    -- one JSON array (or an object keyed by one field), as before
+#   'ndjson'  -- one JSON object per line
+#   'csv'     -- header from the record fields, one row per record
+#   'parquet' -- columnar, written in row groups of `batch` records (needs pyarrow)
+FORMATS = ('json', 'ndjson', 'csv', 'parquet')
+
+
+def parse_int(text):   # '84000', '1 reviews', '1,234' -> int (None if there is no number)
+    match = re.search(r'-?\d+', text.replace(',', ''))
+    return int(match.group()) if match else None
+
+
+def parse_float(text):   # '468.0', '$295.99', '1,234.5' -> float (None if there is no number)
+    match = re.search(r'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?', text.replace(',', ''))
+    return float(match.group()) if match else None
+
+
+class RecordSink:
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonSink(RecordSink):
+
+    def __init__(self, path, key=None, names=None):   # key -- field whose value keys an object instead of an array
+        self.file = open(path, 'w', encoding='utf-8')
+        self.key = key
+        self.names = names or {}   # field -> JSON key, e.g. the keys of files written before the record types existed
+        self.count = 0
+        self.file.write('{' if key else '[')
+
+
+    def write(self, record):
+        data = dataclasses.asdict(record)
+        key = data.pop(self.key) if self.key else None
+        data = {self.names.get(field, field): value for field, value in data.items()}
+        if self.key:
+            text = f'{json.dumps(key)}: {json.dumps(data, indent=4)}'
+        else:
+            text = json.dumps(data, indent=4)
+        self.file.write(('\n    ' if self.count == 0 else ',\n    ') + text.replace('\n', '\n    '))   # indented like json.dump(..., indent=4)
+        self.count += 1
+
+
+    def close(self):
+        self.file.write(('\n' if self.count else '') + ('}' if self.key else ']'))
+        self.file.close()
+
+
+class NdjsonSink(RecordSink):
+
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+
+
+    def write(self, record):
+        self.file.write(json.dumps(dataclasses.asdict(record)) + '\n')
+
+
+    def close(self):
+        self.file.close()
+
+
+class CsvSink(RecordSink):
+
+    def __init__(self, path, record_type):
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([field.name for field in dataclasses.fields(record_type)])
+
+
+    def write(self, record):
+        self.writer.writerow(dataclasses.astuple(record))
+
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink(RecordSink):
+
+    def __init__(self, path, record_type, batch=1024):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("the 'parquet' format needs pyarrow (pip install pyarrow)") from None
+        types = {int: pa.int64(), float: pa.float64(), str: pa.string(), bool: pa.bool_()}
+        self.pa = pa
+        self.schema = pa.schema([(field.name, types[field.type]) for field in dataclasses.fields(record_type)])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.batch = batch
+        self.rows = []
+
+
+    def write(self, record):
+        self.rows.append(dataclasses.asdict(record))
+        if len(self.rows) == self.batch:
+            self.flush()
+
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+# Open a sink writing `record_type` records to '{filename}.{format}' (key and names apply to 'json' only)
+def open_sink(filename, format, record_type, key=None, names=None):
+    path = f'{filename}.{format}'
+    if format == 'json':
+        return JsonSink(path, key, names)
+    if format == 'ndjson':
+        return NdjsonSink(path)
+    if format == 'csv':
+        return CsvSink(path, record_type)
+    if format == 'parquet':
+        return ParquetSink(path, record_type)
+    raise ValueError(f'unknown format {format!r} (expected one of {", ".join(FORMATS)})')
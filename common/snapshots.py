@@ -0,0 +1,85 @@
+import queue
+import threading
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+# Streaming GIF writer -- every frame is encoded and appended to the file as it arrives, none are kept in memory
+class GifStream:
+
+    def __init__(self, path, duration=200, loop=0):
+        self.file = open(path, 'wb')
+        self.duration = duration   # time between frames in ms
+        self.loop = loop   # 0 = loop forever
+        self.frames = 0
+
+
+    def append(self, img):
+        img = img.convert('P')   # grayscale palette shared by all frames
+        if not self.frames:
+            header, _ = GifImagePlugin.getheader(img, info={'loop': self.loop})   # global header taken from the first frame
+            self.file.writelines(header)
+        self.file.writelines(GifImagePlugin.getdata(img, duration=self.duration))
+        self.frames += 1
+
+
+    def close(self):
+        if self.frames:
+            self.file.write(b';')   # GIF trailer
+        self.file.close()
+
+
+# Background snapshot pipeline -- the simulation only downsamples the grid and queues it, a worker thread
+# encodes PNG files and/or streams GIF frames; the bounded queue makes the simulation wait if encoding falls behind
+class SnapshotWriter:
+
+    def __init__(self, prefix=None, animation=None, stride=1, downsample=1, queue_size=8, duration=200):
+        self.prefix = prefix   # PNG files '{prefix}{step}.png'
+        self.stride = max(1, int(stride))   # take a snapshot every stride macrosteps
+        self.downsample = max(1, int(downsample))   # keep every downsample-th row and column
+        self.gif = GifStream(f'{animation}.gif', duration) if animation else None
+        self.error = None
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+
+    def submit(self, step, spins):   # spins -- the grid, or a function returning the grid downsampled by a given step
+        if not (self.prefix or self.gif) or step % self.stride:
+            return
+        if self.error:
+            raise self.error
+        d = self.downsample
+        grid = spins(d) if callable(spins) else spins[::d, ::d]
+        pixels = np.where(grid == 1, 255, 0).astype(np.uint8)   # a copy, so the grid can keep evolving
+        self.queue.put((step, pixels))
+
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error:
+                continue   # keep draining the queue so the simulation never blocks
+            try:
+                self.encode(*item)
+            except Exception as e:
+                self.error = e
+
+
+    def encode(self, step, pixels):   # runs in the worker thread
+        img = Image.fromarray(pixels)
+        if self.prefix:
+            img.save(f'{self.prefix}{step}.png')
+        if self.gif:
+            self.gif.append(img)
+
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.gif:
+            self.gif.close()
+        if self.error:
+            raise self.error
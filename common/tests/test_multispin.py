@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from common import multispin
+
+
+@pytest.mark.parametrize('rho, sign', [(1.0, 1), (0.0, -1)])
+def test_random_lattice_ordered(rho, sign):
+    n = 128
+    words = multispin.random_lattice(n, rho, np.random.default_rng(1))
+    assert multispin.spin_sum(words) == sign * n * n
+    assert np.all(multispin.unpack(words) == sign)
+
+
+def test_random_lattice_density():
+    n = 256
+    words = multispin.random_lattice(n, 0.75, np.random.default_rng(1))
+    assert abs(multispin.spin_sum(words) / n**2 - 0.5) < 0.01   # <s> = 2 rho - 1